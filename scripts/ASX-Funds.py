@@ -1,7 +1,16 @@
 from datetime import datetime
 import os
-import requests
+import asx_workbooks
+import cassette
+import circuit_breaker
+import compaction
+import excel_writer
+import http_session
+import parquet_output
+import parse_pool
+import rate_limiter
 import pandas as pd
+from frame_accumulator import FrameAccumulator
 from bs4 import BeautifulSoup
 
 # CONSTANTS Configurations
@@ -24,6 +33,13 @@ TIME_OUT = 30  # timeout for all web requests, else may hang
 
 OUTPUT_FUNDS_FILE = f'{OUTPUT_DIR}\\ASX Investment Products'
 SAVE_INDIVIDUAL_FILE = False
+DOWNLOAD_WORKERS = 4  # workbooks downloaded at the same time
+PARSE_PROCESSES = os.cpu_count() or 1  # worker processes parsing the workbooks, 1 parses them in this process
+SAVE_PARQUET = True  # also save the combined files as parquet in PARQUET_DIR (needs pyarrow)
+PARQUET_DIR = f'{OUTPUT_DIR}\\parquet'
+CASSETTE_MODE = None  # 'record' saves every web request and response to CASSETTE_FILE, 'replay' serves them from it
+CASSETTE_FILE = f'{OUTPUT_DIR}\\cassette.zip'
+STAND_IN_URL = None  # e.g. 'http://127.0.0.1:8765' sends every request to issuer_stand_in.py instead
 
 def create_dir(dirName):
     try:
@@ -45,7 +61,7 @@ def welcome_log(msg):
 
 def get_all_fund_list(url):
     try:
-        res = requests.get(url, timeout=TIME_OUT)  # pull the containing page
+        res = http_session.get(url, timeout=TIME_OUT)  # pull the containing page
     except  Exception as e:
         generate_log(f'Could not get the containing page {url}: {e}')
         return None
@@ -78,44 +94,15 @@ def get_all_fund_list(url):
 
 
 def get_monthly_products(monthly_data):
-    sheet_df = {}
+    """ Download the monthly workbook into a temporary file, return its name, None if it couldn't be got """
     link = monthly_data['Link']
     fund = monthly_data['Description']
-    period = monthly_data['Period']
 
     try:
-        res = requests.get(link, timeout=TIME_OUT)  # get the file
+        return http_session.download(link, timeout=TIME_OUT)  # stream the file into a temporary file
     except  Exception as e:
         generate_log(f'{fund}\tCould not get the spreadsheet {link}: {e}')
-        return pd.DataFrame()
-
-    xl = pd.ExcelFile(res.content)
-    sheets = xl.sheet_names
-    acquired_sheet = [x for x in sheets if "etp" in x.lower()][0]
-
-    sheet_df['Sheet'] = acquired_sheet
-    sheet_df['SheetNames'] = sheets
-
-    df = pd.read_excel(res.content, sheet_name=acquired_sheet)  # read excel data of given sheet "acquired_sheet" which contains etp
-    df = df.dropna(thresh=5)  # to drop the total row and others mostly null
-    df.dropna(how='all', axis=1, inplace=True)
-    df.columns = df.iloc[0]  # set row index 0 as column
-    df.columns = df.columns.str.replace('\n', '')  # replace newline '\n' with "" from the column name
-
-    asx_code_header_list = df.index[df.columns[0] == 'ASX Code'].tolist()  # Check first column contains "ASX Code or Not
-    if not asx_code_header_list:
-        df.columns = df.iloc[1]  # # column take from row index 1
-        df.columns = df.columns.str.replace('\n', '')  # replace newline '\n' with "" from the column name
-        df = df[2:] # data take from row index 2
-    else:
-        df = df[1:] # data take from row index 1
-
-    # remove nan columns from the df column
-    df = df[df.columns.dropna()]    # df = df.loc[:, df.columns.notnull()]
-    df['Period'] = period  # add "Period" column
-
-    sheet_df['data'] = df
-    return sheet_df
+        return None
 
 # ============================
 # MAIN PROGRAM : START SCRIPT
@@ -124,6 +111,8 @@ if __name__ == "__main__":
     # creating the directories
     create_dir(OUTPUT_DIR)
     create_dir(LOGS_DIR)
+    cassette.start(CASSETTE_MODE, CASSETTE_FILE)
+    http_session.use_stand_in(STAND_IN_URL)
     start = datetime.now()
     start_day = start.strftime("%Y-%m-%d")
 
@@ -134,7 +123,7 @@ if __name__ == "__main__":
     welcome_log(f'\t\t==================================================================================')
     welcome_log(f'\t\t\t\t\t\tFILTER YEARs(FILTER_YEAR) : {FILTER_YEAR}')
 
-    all_funds_df = pd.DataFrame()  # empty data frame to add to
+    all_products = FrameAccumulator()  # the products of every month, put together once at the end
 
     # get all funds lists from the FUND_LIST_URL url
     fund_list = get_all_fund_list(FUND_LIST_URL)
@@ -151,55 +140,65 @@ if __name__ == "__main__":
     if not filtered_fund_list:
         generate_log(f'Your FILTER_YEAR : {FILTER_YEAR} is not valid. Please re-configure FILTER_YEAR.')
     else:
-        for monthly_data in filtered_fund_list:
-            if monthly_data:
-                desc = monthly_data['Description']
-                generate_log(f'{desc}\tStarting .........')
-                response_data = get_monthly_products(monthly_data)
-                if response_data:
-                    exchange = monthly_data['Exchange']
-                    period = monthly_data['Period']
-                    sheet_name = response_data['Sheet']
-                    monthly_data['Sheet'] = sheet_name  # add "Sheet" in funds list
-                    monthly_data['All Sheets'] = response_data['SheetNames']  # add "All Sheets" in funds list
-                    each_df = response_data['data']  # take df from "data"
-
-                    all_funds_df = all_funds_df.append(each_df)
-                    
-                    if SAVE_INDIVIDUAL_FILE:
-                        save_file = f'{OUTPUT_DIR}\\{start.strftime("%Y-%m-%d")}_{desc}.xlsx'
-                        each_df.to_excel(save_file, sheet_name=sheet_name, index=False, freeze_panes=(1, 0))
-
-                    generate_log(f'{desc}\t Sheet({sheet_name})\t\t : completed.')
+        # the workbooks are downloaded in threads and parsed in worker processes, one per core
+        monthly_list = [monthly_data for monthly_data in filtered_fund_list if monthly_data]
+        for monthly_data in monthly_list:
+            generate_log(f'{monthly_data["Description"]}\tStarting .........')
+        parsed = parse_pool.download_and_parse(monthly_list, get_monthly_products, asx_workbooks.read_etp_workbook,
+                                               download_workers=DOWNLOAD_WORKERS, parse_processes=PARSE_PROCESSES)
+        for monthly_data, response_data in parsed:
+            desc = monthly_data['Description']
+            if response_data:
+                exchange = monthly_data['Exchange']
+                period = monthly_data['Period']
+                sheet_name = response_data['Sheet']
+                monthly_data['Sheet'] = sheet_name  # add "Sheet" in funds list
+                monthly_data['All Sheets'] = response_data['SheetNames']  # add "All Sheets" in funds list
+                each_df = response_data['data']  # take df from "data"
+
+                all_products.add(each_df)
+                
+                if SAVE_INDIVIDUAL_FILE:
+                    save_file = f'{OUTPUT_DIR}\\{start.strftime("%Y-%m-%d")}_{desc}.xlsx'
+                    each_df.to_excel(save_file, sheet_name=sheet_name, index=False, freeze_panes=(1, 0))
+
+                generate_log(f'{desc}\t Sheet({sheet_name})\t\t : completed.')
 
         # Creating template dataframe
         template_df = pd.DataFrame(filtered_fund_list)
         # Saving all newly updated df into excel
         template_df.to_excel(INPUT_TEMPLATE_DIR, sheet_name='ASX', index=False, freeze_panes=(1, 0))
 
+        all_funds_df = all_products.frame()
+        all_funds_df, size_before, size_after = compaction.compact(all_funds_df)  # categoricals and floats
+        generate_log(compaction.report(size_before, size_after))
         if not all_funds_df.empty:
-            # save into .xlsx format
-            save_file = OUTPUT_FUNDS_FILE + ".xlsx"
-            all_funds_df.to_excel(save_file, sheet_name='ASX', index=False, freeze_panes=(1, 0))
-            file_bytes_size = os.path.getsize(save_file)
+            if SAVE_PARQUET:
+                # by the month of the workbook, as of date
+                as_of = pd.to_datetime(all_funds_df['Period'], format='%d/%m/%Y').dt.strftime('%Y-%m-%d')
+                generate_log(parquet_output.write(all_funds_df.assign(as_of=as_of), PARQUET_DIR, ['as_of']))
+
+            # save into .xlsx and .csv format, both at the same time
+            excel_writer.save(all_funds_df, OUTPUT_FUNDS_FILE + ".xlsx", OUTPUT_FUNDS_FILE + ".csv", sheet_name='ASX')
+            file_bytes_size = os.path.getsize(OUTPUT_FUNDS_FILE + ".xlsx")
             generate_log(f'')
             generate_log(f'Saved the combined file {OUTPUT_FUNDS_FILE + ".xlsx"} size {round(file_bytes_size/(1024), 0)} KB')
-
-            # save into .csv format
-            save_file = OUTPUT_FUNDS_FILE + ".csv"
-            all_funds_df.to_csv(save_file, index=False)
-            file_bytes_size = os.path.getsize(save_file)
+            file_bytes_size = os.path.getsize(OUTPUT_FUNDS_FILE + ".csv")
             generate_log(f'Saved the combined file {OUTPUT_FUNDS_FILE + ".csv"} size {round(file_bytes_size/(1024), 0)} KB')
 
-end = datetime.now()
-time_taken = end - start
-minute, sec = divmod(time_taken.seconds, 60)
+    # print the request rate each host settled on and the hosts found down
+    for line in rate_limiter.report() + circuit_breaker.report():
+        generate_log(line)
+
+    end = datetime.now()
+    time_taken = end - start
+    minute, sec = divmod(time_taken.seconds, 60)
 
-generate_log(f'')
-generate_log(f'Application took {minute} minutes, {sec} seconds for execution.')
-generate_log(f'***********************************************************************')
-generate_log(f'\t\t\tASX FUNDS : COMPLETED')
-generate_log(f'***********************************************************************\n')
+    generate_log(f'')
+    generate_log(f'Application took {minute} minutes, {sec} seconds for execution.')
+    generate_log(f'***********************************************************************')
+    generate_log(f'\t\t\tASX FUNDS : COMPLETED')
+    generate_log(f'***********************************************************************\n')
 
-lf.close()
-print("Log has been generated at: " + LOGS_DIR + "\\" + logfile)
+    lf.close()
+    print("Log has been generated at: " + LOGS_DIR + "\\" + logfile)
@@ -1,7 +1,14 @@
 from datetime import datetime
 import os
-import requests
+import cassette
+import circuit_breaker
+import compaction
+import excel_writer
+import http_session
+import parquet_output
+import rate_limiter
 import pandas as pd
+from frame_accumulator import FrameAccumulator
 
 # CONSTANTS Configurations
 INVESTMENT_PRODUCTS_LIST = r'D:\Internship\etf\scripts\ASX Price List.xlsx'
@@ -11,7 +18,11 @@ LOGS_DIR = r'D:\Internship\etf\logs\asx-price'
 TIME_OUT = 30  # timeout for all web requests, else may hang
 
 OUTPUT_FUNDS_FILE = f'{OUTPUT_DIR}\\ASX_Shares_price.xlsx'
+SAVE_PARQUET = True  # also save the combined file as parquet in PARQUET_DIR (needs pyarrow)
+PARQUET_DIR = f'{OUTPUT_DIR}\\parquet'
 SAVE_INDIVIDUAL_FILE = False
+CASSETTE_MODE = None  # 'record' saves every web request and response to CASSETTE_FILE, 'replay' serves them from it
+CASSETTE_FILE = f'{OUTPUT_DIR}\\cassette.zip'
 
 # Note that this also determines the column order in the Excel file.
 COLUMN_TO_DISPLAY = ['etf ticker', 'close date', 'close price', 'change price', 'volume',
@@ -58,7 +69,7 @@ def keep_list(k, all):
 def get_shares_price(fund, link):
     # link = f'https://www.asx.com.au/asx/1/share/{fund.upper()}/prices?interval=daily&count=20'
     try:
-        res = requests.get(link, timeout=TIME_OUT)  # get the file
+        res = http_session.get(link, timeout=TIME_OUT)  # get the file
     except  Exception as e:
         generate_log(f'{fund}\tCould not get the spreadsheet {link}: {e}')
         return pd.DataFrame()
@@ -86,6 +97,7 @@ def get_shares_price(fund, link):
 # ============================
 create_dir(OUTPUT_DIR)
 create_dir(LOGS_DIR)
+cassette.start(CASSETTE_MODE, CASSETTE_FILE)
 start = datetime.now()
 
 start_day = start.strftime("%Y-%m-%d")
@@ -96,7 +108,7 @@ welcome_log(f'\t\t==============================================================
 welcome_log(f'\t\t\t\t\t\t\t\t\tASX Shares Price : STARTED')
 welcome_log(f'\t\t==================================================================================')
 
-all_funds = pd.DataFrame()  # empty data frame to add to
+funds_holdings = FrameAccumulator()  # the holdings of every fund, put together once at the end
 
 fund_list = pd.read_excel(INVESTMENT_PRODUCTS_LIST, engine="openpyxl", )
 fund_list.fillna('', inplace=True)  # convert NA to empty string (from float)
@@ -115,14 +127,23 @@ for i in range(len(fund_list)):
         if len(holdings) == 0:
             generate_log(f'{fund}\tFailed to get holdings')
         else:
-            all_funds = all_funds.append(holdings)
+            funds_holdings.add(holdings)
     else:
         generate_log(f'{fund}\tSKIPPING, not a valid link')
 
 # Saving all at the end - riskier
-all_funds.to_excel(OUTPUT_FUNDS_FILE, sheet_name='ASX Shares Price', index=False, freeze_panes=(1, 0))
+all_funds = funds_holdings.frame()
+all_funds, size_before, size_after = compaction.compact(all_funds)  # categoricals and floats
+generate_log(compaction.report(size_before, size_after))
+if SAVE_PARQUET:
+    generate_log(parquet_output.write(all_funds, PARQUET_DIR, [], as_of=start))  # by as of date
+excel_writer.write_xlsx(all_funds, OUTPUT_FUNDS_FILE, sheet_name='ASX Shares Price')  # streamed, in constant memory
 generate_log(f'Saved the combined file {OUTPUT_FUNDS_FILE} size {all_funds.shape}')
 
+# ------ Print the request rate each host settled on and the hosts found down ----------
+for line in rate_limiter.report() + circuit_breaker.report():
+    generate_log(line)
+
 # ------ Print the time taken and Exit ----------
 end = datetime.now()
 time_taken = end - start
@@ -1,7 +1,17 @@
 from datetime import datetime
+from functools import partial
 import os
-import requests
+import asx_workbooks
+import cassette
+import circuit_breaker
+import compaction
+import excel_writer
+import http_session
+import parquet_output
+import parse_pool
+import rate_limiter
 import pandas as pd
+from frame_accumulator import FrameAccumulator
 from bs4 import BeautifulSoup
 
 # CONSTANTS Configurations
@@ -26,6 +36,13 @@ TIME_OUT = 30  # timeout for all web requests, else may hang
 
 OUTPUT_FUNDS_FILE = f'{OUTPUT_DIR}\\ASX Investment Products'
 SAVE_INDIVIDUAL_FILE = False
+DOWNLOAD_WORKERS = 4  # workbooks downloaded at the same time
+PARSE_PROCESSES = os.cpu_count() or 1  # worker processes parsing the workbooks, 1 parses them in this process
+SAVE_PARQUET = True  # also save the combined files as parquet in PARQUET_DIR (needs pyarrow)
+PARQUET_DIR = f'{OUTPUT_DIR}\\parquet'
+CASSETTE_MODE = None  # 'record' saves every web request and response to CASSETTE_FILE, 'replay' serves them from it
+CASSETTE_FILE = f'{OUTPUT_DIR}\\cassette.zip'
+STAND_IN_URL = None  # e.g. 'http://127.0.0.1:8765' sends every request to issuer_stand_in.py instead
 
 
 def create_dir(dirName):
@@ -49,7 +66,7 @@ def welcome_log(msg):
 
 def get_all_fund_list(url):
     try:
-        res = requests.get(url, timeout=TIME_OUT)  # pull the containing page
+        res = http_session.get(url, timeout=TIME_OUT)  # pull the containing page
     except  Exception as e:
         generate_log(f'Could not get the containing page {url}: {e}')
         return None
@@ -82,75 +99,14 @@ def get_all_fund_list(url):
 
 
 def get_monthly_products(monthly_data):
+    """ Download the monthly workbook into a temporary file, return its name, None if it couldn't be got """
     link = monthly_data['Link']
     fund = monthly_data['Description']
-    period = monthly_data['Period']
     try:
-        res = requests.get(link, timeout=TIME_OUT)  # get the file
+        return http_session.download(link, timeout=TIME_OUT)  # stream the file into a temporary file
     except  Exception as e:
         generate_log(f'{fund}\tCould not get the spreadsheet {link}: {e}')
-        return pd.DataFrame()
-
-    xl = pd.ExcelFile(res.content)
-    sheets = xl.sheet_names
-
-    processed_data = []
-    # processed_data.append(sheets)
-    generate_log(f'\t\t Sheets : {sheets}')
-
-    for sheet_name in sheets:
-        each_data = {}
-        df = pd.DataFrame()
-        exists_sheet = [col for col in SHEET_TO_USE if col in sheet_name.upper()]
-        if exists_sheet:
-            generate_log(f'\t\t\t {sheet_name}\treading ...')
-
-            # read excel data of given sheet "acquired_sheet" which contains etp
-            df = pd.read_excel(res.content, sheet_name=sheet_name)
-            df = df.dropna(thresh=5)  # to drop the total row and others mostly null
-            df.dropna(how='all', axis=1, inplace=True)
-            df.columns = df.iloc[0]  # set row index 0 as column
-            df.columns = df.columns.str.replace('\n', '')  # replace newline '\n' with "" from the column name
-
-            if "ETP" in sheet_name.upper():
-                asx_code_header_list = df.index[
-                    df.columns[0] == 'ASX Code'].tolist()  # Check first column contains "ASX Code or Not
-                if not asx_code_header_list:
-                    df.columns = df.iloc[1]  # # column take from row index 1
-                    df.columns = df.columns.str.replace('\n', '')  # replace newline '\n' with "" from the column name
-                    df = df[2:]  # data take from row index 2
-                else:
-                    df = df[1:]  # data take from row index 1
-            else:
-                # data take from row index 1
-                df = df[1:]
-
-                if "LIC" in sheet_name.upper():
-                    # rename the column "Prem/Disc % NTA (pre-tax) at NTA Date" into "Prem/Disc % NTA (pre-tax)"
-                    df.columns = ['Prem/Disc % NTA (pre-tax)' if "Prem/Disc % NTA (pre-tax)" in col else col for col in df.columns]
-                elif "MFUND" in sheet_name.upper():
-                    # rename the column "FUM" into "FUM ($m)#"
-                    df.columns = ['FUM ($m)#' if col == "FUM" in col else col for col in df.columns]
-                    # remove "Historical Distribution Yield" column from the dataframe because it exists only in 2017
-                    df = df.drop(['Historical Distribution Yield'], axis=1, errors='ignore')
-                elif "INFRA" in sheet_name.upper():
-                    # rename the column "Mkt Cap ($m)#" into "Mkt Cap ($m)"
-                    df.columns = ['Mkt Cap ($m)' if 'Mkt Cap ($m)' in col else col for col in df.columns]
-
-            # remove nan columns from the df column  for all sheets
-            df = df[df.columns.dropna()]  # df = df.loc[:, df.columns.notnull()]
-            df['Period'] = period  # add "Period" column
-
-            each_data['Sheet'] = sheet_name
-            each_data['Sheet_df'] = df
-            processed_data.append(each_data)
-        else:
-            generate_log(f'\t\t\t {sheet_name} is not listed in {SHEET_TO_USE}')
-            each_data['Sheet'] = sheet_name
-            each_data['Sheet_df'] = df
-            processed_data.append(each_data)
-
-    return processed_data
+        return None
 
 
 # ============================
@@ -160,6 +116,8 @@ if __name__ == "__main__":
     # creating the directories
     create_dir(OUTPUT_DIR)
     create_dir(LOGS_DIR)
+    cassette.start(CASSETTE_MODE, CASSETTE_FILE)
+    http_session.use_stand_in(STAND_IN_URL)
     start = datetime.now()
     start_day = start.strftime("%Y-%m-%d")
 
@@ -172,7 +130,7 @@ if __name__ == "__main__":
     welcome_log(f'\t\t\t\t\t\tFILTER YEARs(FILTER_YEAR) : {FILTER_YEAR}')
 
     # all_funds_df = pd.DataFrame()
-    all_funds_df = {k: pd.DataFrame() for k in SHEET_TO_USE}  # Empty data frame initialize for each sheet
+    all_funds_df = {k: FrameAccumulator() for k in SHEET_TO_USE}  # the products of each sheet, put together once at the end
 
     # get all funds lists from the FUND_LIST_URL url
     fund_list = get_all_fund_list(FUND_LIST_URL)
@@ -190,55 +148,66 @@ if __name__ == "__main__":
     if not filtered_fund_list:
         generate_log(f'Your FILTER_YEAR : {FILTER_YEAR} is not valid. Please re-configure FILTER_YEAR.')
     else:
-        for monthly_data in filtered_fund_list:
-            if monthly_data:
-                desc = monthly_data['Description']
-                exchange = monthly_data['Exchange']
-                period = monthly_data['Period']
-
-                generate_log(f'{desc}\tStarting .........')
-                response_data = get_monthly_products(monthly_data)
-                if response_data:
-                    for each_sheet_df in response_data:
-                        each_sheet_name = each_sheet_df['Sheet']
-                        each_df = each_sheet_df['Sheet_df']
-                        if not each_df.empty:
-                            valid_sheet = [col for col in SHEET_TO_USE if col in each_sheet_name.upper()]
-                            if valid_sheet:
-                                valid_sheet_name = valid_sheet[0]
-                                # add each df to corresponding sheet
-                                all_funds_df[valid_sheet_name] = all_funds_df[valid_sheet_name].append(each_df)
-                                if SAVE_INDIVIDUAL_FILE:
-                                    save_file = f'{OUTPUT_DIR}\\{start.strftime("%Y-%m-%d")}-{valid_sheet_name}-{desc}.xlsx'
-                                    each_df.to_excel(save_file, sheet_name=valid_sheet_name, index=False, freeze_panes=(1, 0))
-
-                                generate_log(f'{desc}\t Sheet({valid_sheet_name})\t\t : completed.')
+        # the workbooks are downloaded in threads and parsed in worker processes, one per core
+        monthly_list = [monthly_data for monthly_data in filtered_fund_list if monthly_data]
+        for monthly_data in monthly_list:
+            generate_log(f'{monthly_data["Description"]}\tStarting .........')
+        read_products = partial(asx_workbooks.read_product_workbook, sheet_to_use=SHEET_TO_USE)
+        parsed = parse_pool.download_and_parse(monthly_list, get_monthly_products, read_products,
+                                               download_workers=DOWNLOAD_WORKERS, parse_processes=PARSE_PROCESSES)
+        for monthly_data, response_data in parsed:
+            desc = monthly_data['Description']
+            exchange = monthly_data['Exchange']
+            period = monthly_data['Period']
+
+            if response_data:
+                generate_log(f'{desc}\t\t Sheets : {[each_sheet_df["Sheet"] for each_sheet_df in response_data]}')
+                for each_sheet_df in response_data:
+                    each_sheet_name = each_sheet_df['Sheet']
+                    each_df = each_sheet_df['Sheet_df']
+                    if not each_df.empty:
+                        valid_sheet = [col for col in SHEET_TO_USE if col in each_sheet_name.upper()]
+                        if valid_sheet:
+                            valid_sheet_name = valid_sheet[0]
+                            # add each df to corresponding sheet
+                            all_funds_df[valid_sheet_name].add(each_df)
+                            if SAVE_INDIVIDUAL_FILE:
+                                save_file = f'{OUTPUT_DIR}\\{start.strftime("%Y-%m-%d")}-{valid_sheet_name}-{desc}.xlsx'
+                                each_df.to_excel(save_file, sheet_name=valid_sheet_name, index=False, freeze_panes=(1, 0))
+
+                            generate_log(f'{desc}\t Sheet({valid_sheet_name})\t\t : completed.')
 
         for key in all_funds_df.keys():
-            funds = all_funds_df[key]
+            funds = all_funds_df[key].frame()
+            funds, size_before, size_after = compaction.compact(funds)  # categoricals and floats
             if not funds.empty:
-                # save into .xlsx format
-                save_file = OUTPUT_FUNDS_FILE + "-" + key + ".xlsx"
-                funds.to_excel(save_file, sheet_name=key, index=False, freeze_panes=(1, 0))
-                file_bytes_size = os.path.getsize(save_file)
+                if SAVE_PARQUET:
+                    # a dataset per sheet, by the month of the workbook, as of date
+                    as_of = pd.to_datetime(funds['Period'], format='%d/%m/%Y').dt.strftime('%Y-%m-%d')
+                    generate_log(parquet_output.write(funds.assign(as_of=as_of), f'{PARQUET_DIR}\\{key}', ['as_of']))
+
+                # save into .xlsx and .csv format, both at the same time
+                save_file = OUTPUT_FUNDS_FILE + "-" + key
+                excel_writer.save(funds, save_file + ".xlsx", save_file + ".csv", sheet_name=key)
                 generate_log(f'')
-                generate_log(f'Saved the combined file {save_file} size {round(file_bytes_size / (1024), 0)} KB')
-
-                # save into .csv format
-                save_file = OUTPUT_FUNDS_FILE + "-" + key + ".csv"
-                funds.to_csv(save_file, index=False)
-                file_bytes_size = os.path.getsize(save_file)
-                generate_log(f'Saved the combined file {save_file} size {round(file_bytes_size / (1024), 0)} KB')
-
-end = datetime.now()
-time_taken = end - start
-minute, sec = divmod(time_taken.seconds, 60)
-
-generate_log(f'')
-generate_log(f'Application took {minute} minutes, {sec} seconds for execution.')
-generate_log(f'***********************************************************************')
-generate_log(f'\t\t\tASX FUNDS : COMPLETED')
-generate_log(f'***********************************************************************\n')
-
-lf.close()
-print("Log has been generated at: " + LOGS_DIR + "\\" + logfile)
+                generate_log(f'{key}\t{compaction.report(size_before, size_after)}')
+                for save_file in (save_file + ".xlsx", save_file + ".csv"):
+                    file_bytes_size = os.path.getsize(save_file)
+                    generate_log(f'Saved the combined file {save_file} size {round(file_bytes_size / (1024), 0)} KB')
+
+    # print the request rate each host settled on and the hosts found down
+    for line in rate_limiter.report() + circuit_breaker.report():
+        generate_log(line)
+
+    end = datetime.now()
+    time_taken = end - start
+    minute, sec = divmod(time_taken.seconds, 60)
+
+    generate_log(f'')
+    generate_log(f'Application took {minute} minutes, {sec} seconds for execution.')
+    generate_log(f'***********************************************************************')
+    generate_log(f'\t\t\tASX FUNDS : COMPLETED')
+    generate_log(f'***********************************************************************\n')
+
+    lf.close()
+    print("Log has been generated at: " + LOGS_DIR + "\\" + logfile)
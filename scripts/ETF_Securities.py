@@ -30,6 +30,7 @@ import re
 import os
 import requests
 import pandas as pd
+from frame_accumulator import FrameAccumulator
 from bs4 import BeautifulSoup
 
 # CONSTANTS Configurations
@@ -140,7 +141,7 @@ lf = open(f'{LOGS_DIR}\\{logfile}', 'a')
 lf.write('\n' + '-' * 75 + '\n')
 # After renaming columns, keep only these ones in the final file
 # Note that this also determines the column order in the Excel file.
-all_funds = pd.DataFrame()  # empty output frame to add to
+funds_holdings = FrameAccumulator()  # the holdings of every fund, put together once at the end
 
 fund_list = pd.read_excel(INVESTMENT_PRODUCTS_LIST, engine="openpyxl", )
 fund_list.fillna('', inplace=True)  # convert NA to empty string (from float)
@@ -167,13 +168,14 @@ for i in range(len(fund_list)):
             # writelog(f'{fund}\t{issuer}\tAdding {len(holdings)} rows')
             holdings['ETF Category'] = fund_list.loc[i, 'ETF Category']
             holdings['Issuer'] = fund_list.loc[i, 'Issuer']
-            all_funds = all_funds.append(holdings)
+            funds_holdings.add(holdings)
             # all_funds.to_excel(ALL_ETF_SECURITIES_FILE, sheet_name='ETF', index=False, freeze_panes=(1,0))
             # write out the combined DF every time in case of crash
     else:
         writelog(f'{fund}\t{issuer}\tSKIPPING, not a valid link')
 
 # Saving all at the end - riskier
+all_funds = funds_holdings.frame()
 all_funds.to_excel(ALL_ETF_SECURITIES_FILE, sheet_name='ETFS', index=False, freeze_panes=(1, 0))
 print("\n")
 writelog(f'Saved the combined file {ALL_ETF_SECURITIES_FILE} size {all_funds.shape}')
@@ -25,9 +25,26 @@ Change Log
 """
 
 from datetime import datetime
+from functools import partial
 import os
-import requests
+import sys
+import holdings_cache
+import holdings_history
+import holdings_workbooks
+import cassette
+import change_state
+import circuit_breaker
+import compaction
+import excel_writer
+import http_session
+import parquet_output
+import parse_pool
+import payload_archive
+import rate_limiter
 import pandas as pd
+from frame_accumulator import FrameAccumulator
+from fund_runner import fetch_in_order, host_of
+from fund_sink import FundSink
 
 # CONSTANTS Configurations
 INVESTMENT_PRODUCTS_LIST = 'State Street List.xlsx'
@@ -35,8 +52,24 @@ OUTPUT_DIR = r'state-street'
 LOGS_DIR = r'state-street'
 
 TIME_OUT = 30  # timeout for all web requests, else may hang
+MAX_WORKERS = 8  # funds fetched in parallel, 1 fetches them one at a time
+RUN_DEADLINE = 20 * 60  # seconds the run may spend on web requests, the funds left after that fail
+PARSE_PROCESSES = os.cpu_count() or 1  # processes parsing the workbooks, 1 parses them in the fetch threads
 
 ALL_STATE_STREET_SECURITIES_FILE = f'{OUTPUT_DIR}\\All ETF Securities.xlsx'
+SAVE_PARQUET = True  # also save the combined file as parquet in PARQUET_DIR (needs pyarrow)
+PARQUET_DIR = f'{OUTPUT_DIR}\\parquet'
+HISTORY_FILE = f'{OUTPUT_DIR}\\holdings-history.sqlite'  # every version of each fund's holdings, None keeps none
+HOLDINGS_CACHE_DIR = f'{OUTPUT_DIR}\\holdings-cache'  # last holdings of each fund with its file's hash and ETag
+RUNS_DIR = f'{OUTPUT_DIR}\\runs'  # each day's finished funds and run journal, until the run is complete
+CASSETTE_MODE = None  # 'record' saves every web request and response to CASSETTE_FILE, 'replay' serves them from it
+CASSETTE_FILE = f'{OUTPUT_DIR}\\cassette.zip'
+RAW_ARCHIVE_DIR = f'{OUTPUT_DIR}\\raw'  # every holdings file downloaded, compressed, to rebuild past days
+REPARSE_DAYS = None  # e.g. ('20210901', '20210930') rebuilds those days from RAW_ARCHIVE_DIR, no web requests
+REPARSE_DIR = f'{OUTPUT_DIR}\\reparsed'  # the rebuilt days as xlsx, when pyarrow is not installed for PARQUET_DIR
+CHANGE_STATE_DIR = f'{OUTPUT_DIR}\\change-state'  # hash of each fund's last holdings, to tell the unchanged
+CHANGES_FILE = f'{OUTPUT_DIR}\\changes.csv'  # the funds of the last run, new, changed or unchanged, for incremental loads
+STAND_IN_URL = None  # e.g. 'http://127.0.0.1:8765' sends every request to issuer_stand_in.py instead
 
 # Note that this also determines the column order in the Excel file.
 COLUMN_TO_DISPLAY = ['Issuer', 'etf ticker', 'Security Ticker', 'Country Code', 'Security Name', 'Weight %',
@@ -47,6 +80,12 @@ COLUMN_RE_MAPPING = {'Name': 'Security Name',
                      # 'Ticker': 'Security Ticker'
                      }
 
+# the columns read from the holdings file, as named in it, and their types (None: left to pandas)
+COLUMN_DTYPES = {'Name': str, 'Ticker': str, 'Weight (%)': 'float64', 'Sector': str, 'Market Value': 'float64',
+                 'Country': str, 'Number of Shares': 'float64', 'Local Price': 'float64',
+                 'Rate': None, 'Maturity date': None}
+SKIP_ROWS = 4  # rows above the header of the holdings file
+
 
 def create_dir(dirName):
     """ Create if it doesn't exist """
@@ -64,117 +103,165 @@ def writelog(msg):
     return
 
 
-def keep_list(k, all):
-    """ Given a list of columns to keep and
-    a list of columns in the df,
-    Return a list of the overlap in the order of the keep list """
-    intersection = []
-    for c in k:
-        if c in all:
-            intersection.append(c)
-    return intersection
-
-
-def ss_get_holdings(fund, link):
+def ss_get_holdings(fund, link, issuer):
     """ State Street v2.0
     not using the link at all now, just the fund """
 
     file_url = f'https://www.ssga.com/au/en_gb/individual/etfs/library-content/products/fund-data/etfs/apac/holdings-daily-au-en-{fund.lower()}.xlsx'
     try:
-        res = requests.get(file_url, timeout=TIME_OUT)  # get the file
+        res = http_session.get(file_url, timeout=TIME_OUT, headers=holdings_cache.validator_headers(fund))  # get the file
     except  Exception as e:
         writelog(f'{fund}\tCould not get the spreadsheet {file_url}: {e}')
         return pd.DataFrame()
 
-    df = pd.read_excel(res.content, skiprows=4)
-    df = df.dropna(thresh=5)  # to drop the total row and others mostly null
-
-    # Splitting Bloomberg Ticker column into "Security Ticker", "Country Code" columns
-    if "Ticker" in df.columns:
-        is_contains_space = df['Ticker'].str.contains("-").any()
-        if is_contains_space:
-            df[['Security Ticker', 'Country Code']] = df['Ticker'].str.split('-', 0, expand=True)
-        else:
-            df['Security Ticker'] = df['Ticker']
-            df['Country Code'] = None
-
-    # if we find any source columns in the rename dict, rename them
-    for col in COLUMN_RE_MAPPING:
-        if col in list(df):
-            df.rename(columns={col: COLUMN_RE_MAPPING[col]}, inplace=True)
+    payload_archive.save(issuer, fund, start_day, res)  # kept to parse again with --reparse
+    cached = holdings_cache.not_modified(fund, res)  # same file as last time, no need to parse it
+    if cached is not None:
+        return cached
+    cached = holdings_cache.same_file(fund, res.content)  # same file as the last run, no need to parse it
+    if cached is not None:
+        return cached
+    df = parse_pool.run(ss_parse_holdings, fund, res)  # in a worker process
     if save_individual_files:
         save_file = f'{OUTPUT_DIR}\\{start.strftime("%Y%m%d")}_{fund}.xlsx'
         df.to_excel(save_file, sheet_name=fund, index=False, freeze_panes=(1, 0))
+    holdings_cache.save(fund, res, df)  # reused on a 304 Not Modified or the same file
+    return df
 
-    df['Issuer'] = 'State Street'
-    df['etf ticker'] = fund
-    keep = keep_list(COLUMN_TO_DISPLAY, list(df))
-    return df[keep]
-
-
-# ============================
-#      START SCRIPT FROM HERE
-# ============================
-print("======================================================================")
-print("                 State Street - Holdings EXTRACT: STARTED             ")
-print("======================================================================")
-
-create_dir(OUTPUT_DIR)
-create_dir(LOGS_DIR)
-start = datetime.now()
-start_day = start.strftime("%Y%m%d")
-save_individual_files = False
 
-logfile = f'{start_day}_{os.path.basename(__file__).split(".")[0]}.log'
-lf = open(f'{LOGS_DIR}\\{logfile}', 'a')
-lf.write('\n' + '-' * 75 + '\n')
+# the holdings of the fund from its downloaded file, see holdings_workbooks
+ss_parse_holdings = partial(holdings_workbooks.read_state_street, column_dtypes=COLUMN_DTYPES,
+                            column_re_mapping=COLUMN_RE_MAPPING, columns=COLUMN_TO_DISPLAY, skiprows=SKIP_ROWS)
 
-all_funds = pd.DataFrame()  # empty output frame to add to
 
-fund_list = pd.read_excel(INVESTMENT_PRODUCTS_LIST, engine="openpyxl", )
-fund_list.fillna('', inplace=True)  # convert NA to empty string (from float)
-
-# ---------- Main Loop ---------- #
-
-for i in range(len(fund_list)):
+def get_fund_holdings(i):
+    """ Fetch the holdings of row i of the fund list, None if the row is skipped """
     # take care - headings are case sensitive
     fund = fund_list.loc[i, 'ASX Code']
     # etf_cat = fund_list.loc[i,'ETF Category']
     link = fund_list.loc[i, 'Link']
     issuer = fund_list.loc[i, 'Issuer']
     writelog(f'{fund}\t{issuer}\tStarting...')
+    if run_sink.finished(fund):
+        writelog(f'{fund}\t{issuer}\tFinished by an earlier run today, reading its saved holdings')
+        return run_sink.holdings(fund)
     if len(link) > 4:  # skip NA
         if issuer.lower().startswith('state street'):
-            holdings = ss_get_holdings(fund, link)
-
+            holdings = ss_get_holdings(fund, link, issuer)
         else:
             writelog(f'{fund}\t{issuer}\tDid not recognise this issuer')
+            return pd.DataFrame()
+        if len(holdings) > 0:
+            holdings['ETF Category'] = fund_list.loc[i, 'ETF Category']
+            holdings['Issuer'] = fund_list.loc[i, 'Issuer']
+            run_sink.save(fund, holdings)  # on disk as soon as it is done, in the thread that fetched it
+        return holdings
+    writelog(f'{fund}\t{issuer}\tSKIPPING, not a valid link')
+    return None
+
 
+# ============================
+#      START SCRIPT FROM HERE
+# ============================
+if __name__ == "__main__":
+    print("======================================================================")
+    print("                 State Street - Holdings EXTRACT: STARTED             ")
+    print("======================================================================")
+
+    create_dir(OUTPUT_DIR)
+    create_dir(LOGS_DIR)
+    http_session.configure(pool_size=MAX_WORKERS)  # one kept-alive connection per parallel fetch
+    http_session.set_deadline(RUN_DEADLINE)
+    cassette.start(CASSETTE_MODE, CASSETTE_FILE)
+    http_session.use_stand_in(STAND_IN_URL)
+    # a cassette replay or the stand-in are not the issuers' files of today, keep them out of the caches and the history
+    offline_run = cassette.replaying() or bool(STAND_IN_URL)
+    parser_version = change_state.parser_version(ss_parse_holdings)  # saved frames of other versions are parsed again
+    holdings_cache.load(None if offline_run else HOLDINGS_CACHE_DIR, parser_version)
+    payload_archive.load(None if offline_run else RAW_ARCHIVE_DIR)
+    change_state.load(None if offline_run else CHANGE_STATE_DIR)
+    reparse_days = payload_archive.reparse_days(sys.argv[1:], REPARSE_DAYS)  # --reparse FIRST_DAY [LAST_DAY]
+    start = datetime.now()
+    start_day = start.strftime("%Y%m%d")
+    save_individual_files = False
+    parse_pool.start(PARSE_PROCESSES)
+
+    logfile = f'{start_day}_{os.path.basename(__file__).split(".")[0]}.log'
+    lf = open(f'{LOGS_DIR}\\{logfile}', 'a')
+    lf.write('\n' + '-' * 75 + '\n')
+
+    fund_list = pd.read_excel(INVESTMENT_PRODUCTS_LIST, engine="openpyxl", )
+    fund_list.fillna('', inplace=True)  # convert NA to empty string (from float)
+
+    if reparse_days:  # rebuild those days from the archive instead of fetching today's holdings
+        create_dir(REPARSE_DIR)
+        writelog(f'Rebuilding the days from {reparse_days[0]} to {reparse_days[1]} from {RAW_ARCHIVE_DIR}')
+        categories = dict(zip(fund_list['ASX Code'], fund_list['ETF Category']))
+        for line in payload_archive.rebuild(*reparse_days, ss_parse_holdings, categories, ALL_STATE_STREET_SECURITIES_FILE,
+                                            'ETF', REPARSE_DIR, PARQUET_DIR if SAVE_PARQUET else None,
+                                            HISTORY_FILE, max_workers=MAX_WORKERS):
+            writelog(line)
+        parse_pool.stop()
+        m, s = divmod((datetime.now() - start).seconds, 60)
+        writelog(f'This took {m} minutes, {s} seconds')
+        lf.close()
+        sys.exit()
+
+    funds_holdings = FrameAccumulator()  # the holdings of every fund, put together once at the end
+    run_dir = f'{RUNS_DIR}\\{start_day}' + ('-offline' if offline_run else '')
+    run_sink = FundSink(run_dir)  # funds finished by a run today that crashed are not fetched again
+
+    # ---------- Main Loop ---------- #
+    # the funds are fetched in parallel but the results come back in fund list order
+    fund_rows = range(len(fund_list))
+    all_holdings = fetch_in_order(fund_rows, get_fund_holdings, host=lambda i: host_of(fund_list.loc[i, 'Link']),
+                                  max_workers=MAX_WORKERS)
+    for i, holdings in zip(fund_rows, all_holdings):
+        if holdings is None:  # skipped, not a valid link
+            continue
+        fund = fund_list.loc[i, 'ASX Code']
+        issuer = fund_list.loc[i, 'Issuer']
         # if the function returned an empty dataframe, skip
         if len(holdings) == 0:
             writelog(f'{fund}\t{issuer}\tFailed to get holdings')
         else:
             # writelog(f'{fund}\t{issuer}\tAdding {len(holdings)} rows')
-            holdings['ETF Category'] = fund_list.loc[i, 'ETF Category']
-            holdings['Issuer'] = fund_list.loc[i, 'Issuer']
-            all_funds = all_funds.append(holdings)
+            if change_state.mark(fund, holdings, start_day) == change_state.UNCHANGED:
+                writelog(f'{fund}\t{issuer}\tUnchanged since the last run')
+            funds_holdings.add(holdings)
             # all_funds.to_excel(ALL_STATE_STREET_SECURITIES_FILE, sheet_name='ETF', index=False, freeze_panes=(1,0))
             # write out the combined DF every time in case of crash
+
+    parse_pool.stop()  # every workbook is parsed
+    # Saving all at the end - riskier
+    all_funds = funds_holdings.frame()
+    all_funds, size_before, size_after = compaction.compact(all_funds)  # categoricals and floats
+    writelog(compaction.report(size_before, size_after))
+    if SAVE_PARQUET:
+        writelog(parquet_output.write(all_funds, PARQUET_DIR, ['Issuer'], as_of=start))  # by Issuer and as of date
+    if HISTORY_FILE and not offline_run:
+        writelog(holdings_history.update(all_funds, HISTORY_FILE, start))  # only the changes add rows
+    if change_state.all_unchanged() and os.path.exists(ALL_STATE_STREET_SECURITIES_FILE):
+        writelog(f'No fund changed since the last run, {ALL_STATE_STREET_SECURITIES_FILE} is left as it is')
     else:
-        writelog(f'{fund}\t{issuer}\tSKIPPING, not a valid link')
-
-# Saving all at the end - riskier
-all_funds.to_excel(ALL_STATE_STREET_SECURITIES_FILE, sheet_name='ETF', index=False, freeze_panes=(1, 0))
-print("\n")
-writelog(f'Saved the combined file {ALL_STATE_STREET_SECURITIES_FILE} size {all_funds.shape}')
-
-# ------ Print the time taken and Exit ----------
-end = datetime.now()
-time_taken = end - start
-# writelog(f'Finished at {end.strftime("%H:%M:%S")}')
-m, s = divmod(time_taken.seconds, 60)
-writelog(f'This took {m} minutes, {s} seconds for {len(fund_list)} funds')
-
-print("\n***********************************************************************")
-print("                  State Street - Holdings EXTRACT : COMPLETED            ")
-print("***********************************************************************")
\ No newline at end of file
+        excel_writer.write_xlsx(all_funds, ALL_STATE_STREET_SECURITIES_FILE, sheet_name='ETF')  # streamed, in constant memory
+        print("\n")
+        writelog(f'Saved the combined file {ALL_STATE_STREET_SECURITIES_FILE} size {all_funds.shape}')
+    change_state.write_changes(CHANGES_FILE)  # new, changed and unchanged funds for the incremental loads
+    change_state.save()
+    run_sink.remove()  # the combined file is saved, the next run starts afresh
+
+    # ------ Print the request rate each host settled on and the hosts found down ----------
+    for line in change_state.report() + rate_limiter.report() + circuit_breaker.report():
+        writelog(line)
+
+    # ------ Print the time taken and Exit ----------
+    end = datetime.now()
+    time_taken = end - start
+    # writelog(f'Finished at {end.strftime("%H:%M:%S")}')
+    m, s = divmod(time_taken.seconds, 60)
+    writelog(f'This took {m} minutes, {s} seconds for {len(fund_list)} funds')
+
+    print("\n***********************************************************************")
+    print("                  State Street - Holdings EXTRACT : COMPLETED            ")
+    print("***********************************************************************")
\ No newline at end of file
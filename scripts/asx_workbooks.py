@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Parse the ASX monthly funds statistics workbooks
+
+The parse functions of ASX-Funds.py and All_SheetWise_ASX-Funds.py, kept in a
+module of their own so parse_pool can run them in worker processes: they
+only take the downloaded file and the row of the fund list, don't log and
+return plain frames.
+"""
+
+import pandas as pd
+import excel_reader
+
+
+def read_etp_workbook(monthly_data, file_name):
+    """ Read the sheet which contains etp of a monthly workbook
+    Returns dict of the sheet name ('Sheet'), all the sheet names ('SheetNames') and its data ('data') """
+    sheet_df = {}
+    period = monthly_data['Period']
+
+    # open the workbook once for the sheet names and the data of the sheets which contain etp
+    sheets, sheet_frames = excel_reader.read_sheets(file_name, lambda sheet: "etp" in sheet.lower())
+    acquired_sheet = [x for x in sheets if "etp" in x.lower()][0]
+
+    sheet_df['Sheet'] = acquired_sheet
+    sheet_df['SheetNames'] = sheets
+
+    df = sheet_frames[acquired_sheet]  # excel data of given sheet "acquired_sheet" which contains etp
+    df = df.dropna(thresh=5)  # to drop the total row and others mostly null
+    df.dropna(how='all', axis=1, inplace=True)
+    df.columns = df.iloc[0]  # set row index 0 as column
+    df.columns = df.columns.str.replace('\n', '')  # replace newline '\n' with "" from the column name
+
+    asx_code_header_list = df.index[df.columns[0] == 'ASX Code'].tolist()  # Check first column contains "ASX Code or Not
+    if not asx_code_header_list:
+        df.columns = df.iloc[1]  # # column take from row index 1
+        df.columns = df.columns.str.replace('\n', '')  # replace newline '\n' with "" from the column name
+        df = df[2:] # data take from row index 2
+    else:
+        df = df[1:] # data take from row index 1
+
+    # remove nan columns from the df column
+    df = df[df.columns.dropna()]    # df = df.loc[:, df.columns.notnull()]
+    df['Period'] = period  # add "Period" column
+
+    sheet_df['data'] = df
+    return sheet_df
+
+
+def read_product_workbook(monthly_data, file_name, sheet_to_use):
+    """ Read every sheet of a monthly workbook whose name contains one of sheet_to_use
+    Returns a list of dict of the sheet name ('Sheet') and its data ('Sheet_df'), for all
+    the sheets of the workbook, Sheet_df is empty for the ones not in sheet_to_use """
+    period = monthly_data['Period']
+
+    # open the workbook once and read all the sheets in sheet_to_use from it
+    sheets, sheet_frames = excel_reader.read_sheets(
+        file_name, lambda sheet: any(col in sheet.upper() for col in sheet_to_use))
+
+    processed_data = []
+
+    for sheet_name in sheets:
+        each_data = {}
+        df = pd.DataFrame()
+        exists_sheet = [col for col in sheet_to_use if col in sheet_name.upper()]
+        if exists_sheet:
+            # excel data of given sheet "acquired_sheet" which contains etp
+            df = sheet_frames[sheet_name]
+            df = df.dropna(thresh=5)  # to drop the total row and others mostly null
+            df.dropna(how='all', axis=1, inplace=True)
+            df.columns = df.iloc[0]  # set row index 0 as column
+            df.columns = df.columns.str.replace('\n', '')  # replace newline '\n' with "" from the column name
+
+            if "ETP" in sheet_name.upper():
+                asx_code_header_list = df.index[
+                    df.columns[0] == 'ASX Code'].tolist()  # Check first column contains "ASX Code or Not
+                if not asx_code_header_list:
+                    df.columns = df.iloc[1]  # # column take from row index 1
+                    df.columns = df.columns.str.replace('\n', '')  # replace newline '\n' with "" from the column name
+                    df = df[2:]  # data take from row index 2
+                else:
+                    df = df[1:]  # data take from row index 1
+            else:
+                # data take from row index 1
+                df = df[1:]
+
+                if "LIC" in sheet_name.upper():
+                    # rename the column "Prem/Disc % NTA (pre-tax) at NTA Date" into "Prem/Disc % NTA (pre-tax)"
+                    df.columns = ['Prem/Disc % NTA (pre-tax)' if "Prem/Disc % NTA (pre-tax)" in col else col for col in df.columns]
+                elif "MFUND" in sheet_name.upper():
+                    # rename the column "FUM" into "FUM ($m)#"
+                    df.columns = ['FUM ($m)#' if col == "FUM" in col else col for col in df.columns]
+                    # remove "Historical Distribution Yield" column from the dataframe because it exists only in 2017
+                    df = df.drop(['Historical Distribution Yield'], axis=1, errors='ignore')
+                elif "INFRA" in sheet_name.upper():
+                    # rename the column "Mkt Cap ($m)#" into "Mkt Cap ($m)"
+                    df.columns = ['Mkt Cap ($m)' if 'Mkt Cap ($m)' in col else col for col in df.columns]
+
+            # remove nan columns from the df column  for all sheets
+            df = df[df.columns.dropna()]  # df = df.loc[:, df.columns.notnull()]
+            df['Period'] = period  # add "Period" column
+
+        each_data['Sheet'] = sheet_name
+        each_data['Sheet_df'] = df
+        processed_data.append(each_data)
+
+    return processed_data
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Record / replay of web requests for offline, repeatable runs
+
+In 'record' mode every request made through http_session is saved with its
+response (landing pages, CSV / XLSX files, the Russell form POST, the ASX JSON
+prices) in one zip file. In 'replay' mode the responses are served from that
+file and nothing goes to the network, so the parse and transform steps can be
+profiled and compared between changes on exactly the same input.
+
+Each response body is stored once in the zip, named by its SHA-1, and
+index.json maps every request to its status, headers and body.
+"""
+
+from hashlib import sha1
+import atexit
+import json
+from threading import Lock
+from urllib.parse import urlencode
+import zipfile
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+# headers that describe the transfer, not the body that is saved
+TRANSFER_HEADERS = ['Content-Encoding', 'Transfer-Encoding', 'Content-Length', 'Connection', 'Keep-Alive']
+# a recording holds the full files, not 304 answers to our cache's validators
+VALIDATOR_HEADERS = ['If-None-Match', 'If-Modified-Since']
+
+mode = None
+archive = None
+index = {}
+bodies = set()  # names of the bodies already in the archive
+lock = Lock()
+
+
+class CassetteMiss(requests.ConnectionError):
+    """ Replaying and the request was not recorded """
+
+
+def start(cassette_mode, file_name):
+    """ Start recording to or replaying from file_name, cassette_mode None does nothing """
+    global mode, archive, index, bodies
+    if not cassette_mode:
+        return
+    if cassette_mode not in (RECORD, REPLAY):
+        raise ValueError(f'cassette mode must be {RECORD!r} or {REPLAY!r}, not {cassette_mode!r}')
+    with lock:
+        mode = cassette_mode
+        if mode == RECORD:
+            archive = zipfile.ZipFile(file_name, 'w', compression=zipfile.ZIP_DEFLATED)
+            index = {}
+            bodies = set()
+            atexit.register(stop)
+        else:
+            archive = zipfile.ZipFile(file_name, 'r')
+            index = json.loads(archive.read('index.json'))
+
+
+def stop():
+    """ Finish the recording (write its index) or the replay """
+    global mode, archive
+    with lock:
+        if archive is None:
+            return
+        if mode == RECORD:
+            archive.writestr('index.json', json.dumps(index, indent=1))
+        archive.close()
+        archive = None
+        mode = None
+
+
+def recording():
+    return mode == RECORD
+
+
+def replaying():
+    return mode == REPLAY
+
+
+def request_key(method, url, kwargs):
+    """ The key of a request in the index: method, url and any form data or params """
+    key = f'{method.upper()} {url}'
+    for name in ('params', 'data'):
+        value = kwargs.get(name)
+        if value:
+            key += ' ' + (urlencode(sorted(value.items())) if isinstance(value, dict) else str(value))
+    return key
+
+
+def without_validators(kwargs):
+    """ kwargs for the real request while recording, without If-None-Match / If-Modified-Since """
+    headers = kwargs.get('headers')
+    if not headers:
+        return kwargs
+    headers = {k: v for k, v in headers.items() if k not in VALIDATOR_HEADERS}
+    return dict(kwargs, headers=headers)
+
+
+def record(method, url, kwargs, res):
+    """ Save the response of the request """
+    body = res.content
+    body_name = 'bodies/' + sha1(body).hexdigest()
+    headers = {k: v for k, v in res.headers.items() if k not in TRANSFER_HEADERS}
+    with lock:
+        if archive is None:
+            return
+        if body_name not in bodies:
+            archive.writestr(body_name, body)
+            bodies.add(body_name)
+        index[request_key(method, url, kwargs)] = {'status': res.status_code, 'url': res.url,
+                                                   'headers': headers, 'body': body_name}
+
+
+def replay(method, url, kwargs):
+    """ Return the recorded response of the request, raise CassetteMiss if there isn't one """
+    key = request_key(method, url, kwargs)
+    with lock:
+        entry = index.get(key)
+        if entry is None:
+            raise CassetteMiss(f'{key} is not in the cassette')
+        body = archive.read(entry['body'])
+    res = requests.Response()
+    res.status_code = entry['status']
+    res.headers = CaseInsensitiveDict(entry['headers'])
+    res.encoding = get_encoding_from_headers(res.headers)
+    res.url = entry['url']
+    res.reason = 'Replayed'
+    res._content = body
+    res._content_consumed = True  # iter_content serves the body instead of reading the network
+    res.request = requests.Request(method, url).prepare()
+    return res
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Tell the funds whose holdings changed since the last run from the ones that didn't
+
+Index ETFs publish the same holdings day after day between rebalances, yet
+every run rewrote them. For each fund the state file keeps the SHA-256 of the
+holdings frame of the last run (the normalized frame), which also catches the
+files that differ only in their preamble (e.g. an "as of" date) but hold the
+same rows. Each fund of the run is marked new, changed or unchanged,
+write_changes saves that list for the incremental loads downstream and
+all_unchanged tells when the combined file doesn't need to be written again.
+
+A file that is the same as last time is not parsed again, holdings_cache
+keeps the frame made from it. It is only reused with the parser that made it:
+parser_version hashes the parse function and the column settings it reads.
+"""
+
+import csv
+from functools import partial
+from hashlib import sha256
+import inspect
+import json
+import os
+from threading import Lock
+import pandas as pd
+
+STATE_DIR = 'change-state'
+STATE_FILE = 'state.json'
+
+NEW = 'new'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+
+state_dir = None  # None keeps no state, every fund is new
+funds = {}  # fund -> {'frame': hash, 'rows': ..., 'changed': day}
+last_run = set()  # the funds of the last run
+statuses = {}  # fund -> NEW, CHANGED or UNCHANGED, for this run
+lock = Lock()
+
+
+def load(dir_name=STATE_DIR):
+    """ Keep the state in dir_name, create it if it doesn't exist and read the last run's state
+    dir_name None keeps no state """
+    global state_dir, funds, last_run, statuses
+    with lock:
+        state_dir = dir_name
+        funds, last_run, statuses = {}, set(), {}
+        if state_dir is None:
+            return
+        os.makedirs(state_dir, exist_ok=True)
+        try:
+            with open(os.path.join(state_dir, STATE_FILE)) as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            saved = {}
+        funds = saved.get('funds', {})
+        last_run = set(saved.get('last_run', []))
+        statuses = {}
+
+
+def parser_version(parse, *settings):
+    """ Short hash of the parse function's code (a functools.partial's keywords too) and of the
+    settings it reads, e.g. the column mapping, dtypes and skiprows """
+    func = parse.func if isinstance(parse, partial) else parse
+    try:
+        code = inspect.getsource(func)
+    except (OSError, TypeError):
+        code = f'{func.__module__}.{func.__qualname__}'
+    keywords = sorted(parse.keywords.items()) if isinstance(parse, partial) else []
+    return sha256(repr((code, keywords, settings)).encode()).hexdigest()[:16]
+
+
+def frame_hash(df):
+    """ Hash of the frame's columns and values, the same for the same rows in the same order """
+    h = sha256('\x1f'.join(str(col) for col in df.columns).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def mark(fund, df, day):
+    """ Mark the fund's holdings of the run new, changed or unchanged since the last run, return which """
+    digest = frame_hash(df)
+    with lock:
+        saved = funds.setdefault(fund, {})
+        if 'frame' not in saved:
+            status = NEW
+        elif saved['frame'] != digest:
+            status = CHANGED
+        else:
+            status = UNCHANGED
+        if status != UNCHANGED:
+            saved.update(frame=digest, changed=day)
+        saved['rows'] = len(df)
+        statuses[fund] = status
+    return status
+
+
+def all_unchanged():
+    """ True if the run has the same funds as the last one and none of them changed """
+    with lock:
+        return set(statuses) == last_run and all(status == UNCHANGED for status in statuses.values())
+
+
+def save():
+    """ Write the state of the run, the next run compares against it """
+    if state_dir is None:
+        return
+    with lock:
+        file_path = os.path.join(state_dir, STATE_FILE)
+        with open(file_path + '.tmp', 'w') as f:
+            json.dump({'funds': funds, 'last_run': sorted(statuses)}, f, indent=1, sort_keys=True)
+        os.replace(file_path + '.tmp', file_path)  # never leave a half written state behind
+
+
+def write_changes(file_name):
+    """ Save the funds of the run with their status, rows and the day their holdings last changed """
+    with lock:
+        rows = [[fund, status, funds[fund].get('rows'), funds[fund].get('changed')]
+                for fund, status in sorted(statuses.items())]
+        removed = sorted(last_run - set(statuses))
+    with open(file_name, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['etf ticker', 'Status', 'Rows', 'Changed'])
+        writer.writerows(rows)
+        writer.writerows([fund, 'removed', 0, None] for fund in removed)
+
+
+def report():
+    """ Log lines for the run's summary """
+    with lock:
+        counts = {status: 0 for status in (NEW, CHANGED, UNCHANGED)}
+        for status in statuses.values():
+            counts[status] += 1
+        removed = len(last_run - set(statuses))
+    return [f'Funds new {counts[NEW]}, changed {counts[CHANGED]}, unchanged {counts[UNCHANGED]}, '
+            f'no longer in the run {removed}']
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Per host circuit breaker
+
+When an issuer's site is down every one of its funds used to wait the full
+TIME_OUT, and with retries even longer. After FAILURE_THRESHOLD failures in a
+row the breaker of the host opens and its requests fail straight away. After
+OPEN_SECONDS one trial request is let through: if it works the breaker closes
+again, if not it stays open for another OPEN_SECONDS.
+"""
+
+from threading import Lock
+import time
+import requests
+
+FAILURE_THRESHOLD = 5  # failures in a row that open the breaker
+OPEN_SECONDS = 60  # how long an open breaker fails requests before letting a trial one through
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """ The host has failed too often, the request was not sent """
+
+
+class HostBreaker:
+    """ Circuit breaker of one host """
+
+    def __init__(self, host):
+        self.host = host
+        self.failures = 0
+        self.opened = None  # time the breaker opened, None while closed
+        self.trial_running = False
+        self.times_opened = 0
+        self.lock = Lock()
+
+    def check(self):
+        """ Raise CircuitOpenError if requests to the host should not be sent now """
+        with self.lock:
+            if self.opened is None:
+                return
+            if not self.trial_running and time.monotonic() - self.opened >= OPEN_SECONDS:
+                self.trial_running = True  # half open, this request is the trial
+                return
+        raise CircuitOpenError(f'{self.host} failed {self.failures} times in a row, not trying it for now')
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial_running = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or (self.opened is None and self.failures >= FAILURE_THRESHOLD):
+                if self.opened is None:
+                    self.times_opened += 1
+                self.opened = time.monotonic()
+                self.trial_running = False
+
+
+host_breakers = {}
+host_breakers_lock = Lock()
+
+
+def for_host(host):
+    """ Return the breaker of the host, create it on first use """
+    with host_breakers_lock:
+        if host not in host_breakers:
+            host_breakers[host] = HostBreaker(host)
+        return host_breakers[host]
+
+
+def report():
+    """ One line per host whose breaker opened during the run """
+    with host_breakers_lock:
+        breakers = list(host_breakers.values())
+    return [f'{b.host}\tcircuit breaker opened {b.times_opened} times, {"still open" if b.opened else "closed"}'
+            for b in breakers if b.times_opened]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Shrink the combined holdings table before it is saved or compared
+
+The combined table repeats the same few strings (Issuer, etf ticker, ETF
+Category, Country Code, Sector, Country ...) on every row and often holds
+Weight % and Market Value as text. compact turns columns of repeated text
+into categoricals and columns of numbers written as text ('1,234.50', '12%')
+into float columns, and gives the bytes the table took before and after.
+The floats stay float64: the compacted table is the one written to the xlsx
+and csv files, and float32 would write 0.097054 as 0.09705399721860886.
+"""
+
+from pandas.api.types import (is_bool_dtype, is_float_dtype, is_integer_dtype, is_numeric_dtype, is_object_dtype,
+                              is_string_dtype)
+import pandas as pd
+
+CATEGORY_RATIO = 0.5  # text columns with fewer distinct values than this share of the rows become categorical
+# identifiers that can look like numbers ('0700', SEDOLs) but must stay text
+TEXT_COLUMNS = ['Security Ticker', 'etf ticker', 'ASX Code', 'SEDOL', 'EtfIdentifier', 'Security Name',
+                'Country Code']
+
+
+def memory(df):
+    """ Bytes the frame takes, text included """
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def numbers(values):
+    """ values parsed as numbers, '1,234.5', '12%' and '$3' too, None if any of them isn't one """
+    if is_numeric_dtype(values) and not is_bool_dtype(values):
+        return values
+    text = values.astype(str).str.replace(r'[,$%\s]', '', regex=True)
+    parsed = pd.to_numeric(text.where(values.notna()), errors='coerce')
+    if parsed.notna().sum() < values.notna().sum():
+        return None
+    return parsed
+
+
+def compact_column(name, values):
+    """ The column in the smallest type that holds its values """
+    if isinstance(values.dtype, pd.CategoricalDtype) or is_bool_dtype(values):
+        return values
+    if not (is_numeric_dtype(values) or is_object_dtype(values) or is_string_dtype(values)):
+        return values  # dates and the like
+    if name not in TEXT_COLUMNS:
+        parsed = numbers(values)
+        if parsed is not None and (parsed.notna().any() or is_numeric_dtype(values)):
+            if is_integer_dtype(parsed):
+                return pd.to_numeric(parsed, downcast='integer')
+            if is_float_dtype(parsed):
+                return parsed.astype('float64')  # float32 would change the published values
+    if values.nunique() <= CATEGORY_RATIO * len(values):
+        return values.astype('category')
+    return values
+
+
+def compact(df):
+    """ Return df with its columns in compact types, and the bytes it took before and after """
+    before = memory(df)
+    if df.columns.empty:
+        return df, before, before
+    df = pd.concat([compact_column(name, df.iloc[:, n]) for n, name in enumerate(df.columns)], axis=1)
+    return df, before, memory(df)
+
+
+def report(before, after):
+    """ Log line for the bytes compact saved """
+    saved = 100 * (before - after) / before if before else 0
+    return f'Compacted the combined table from {before / 2 ** 20:.1f} MB to {after / 2 ** 20:.1f} MB ({saved:.0f}% saved)'
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Read the data block of a holdings CSV that has a preamble or a footer
+
+The issuer CSVs have lines of fund details above the header and notes below
+the data. Instead of parsing the text, looking for the header and parsing it
+again (iShares), or splitting it into lines and joining them back (BetaShares),
+the functions here find where the data block starts and ends in one scan of
+the text and give pd.read_csv a window on that part of it, which is read a
+chunk at a time without copying the block.
+"""
+
+import re
+
+
+class TextWindow:
+    """ Read only text file over text[start:end] """
+
+    def __init__(self, text, start=0, end=None):
+        self.text = text
+        self.pos = start
+        self.end = len(text) if end is None else end
+
+    def read(self, size=-1):
+        stop = self.end if size is None or size < 0 else min(self.end, self.pos + size)
+        chunk = self.text[self.pos:stop]
+        self.pos = stop
+        return chunk
+
+    def readline(self, size=-1):
+        stop = self.text.find('\n', self.pos, self.end)
+        stop = self.end if stop < 0 else stop + 1
+        if size is not None and size >= 0:
+            stop = min(stop, self.pos + size)
+        line = self.text[self.pos:stop]
+        self.pos = stop
+        return line
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos):
+        self.pos = pos
+        return pos
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+
+def line_start(text, skip_lines):
+    """ Position of the line after the first skip_lines lines of text """
+    pos = 0
+    for _ in range(skip_lines):
+        pos = text.find('\n', pos)
+        if pos < 0:
+            return len(text)
+        pos += 1
+    return pos
+
+
+def line_end(text, skip_lines):
+    """ Position of the end of the line before the last skip_lines lines of text
+    (counted like text.split('\\n'), so a final newline ends an empty last line) """
+    pos = len(text)
+    for _ in range(skip_lines):
+        pos = text.rfind('\n', 0, pos)
+        if pos < 0:
+            return 0
+    return pos
+
+
+def between_lines(text, head, foot):
+    """ Window on text without its first head and last foot lines
+    the same text as '\\n'.join(lines[head:max(0, len(lines) - foot)]) with lines = text.split('\\n') """
+    start = line_start(text, head)
+    return TextWindow(text, start, max(start, line_end(text, foot)))
+
+
+def from_last_header(text, header, skip_lines=0):
+    """ Window on text from the last line starting with the column name header
+    (quoted or not) to the end, None if there is no such line after the first skip_lines lines """
+    pattern = re.compile(r'^"?' + re.escape(header) + r'"?,', re.MULTILINE)
+    found = None
+    for found in pattern.finditer(text, line_start(text, skip_lines)):
+        pass
+    if found is None:
+        return None
+    return TextWindow(text, found.start())
+
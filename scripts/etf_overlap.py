@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Overlap of every pair of ETFs, precomputed for the ETF Holdings Comparison tool
+
+The comparison tool worked the overlap of two ETFs out in Power BI, a DAX
+measure that gets slower with every ETF added. overlaps builds the ETF x
+security weight matrix of the combined holdings, sparse and by security
+column, and works out for every pair of ETFs at once the securities they
+both hold and their weighted overlap, the sum over those securities of the
+smaller of the two weights. Only the pairs inside each security's column are
+visited, so it takes seconds for hundreds of ETFs and tens of thousands of
+securities.
+
+Run it after the issuer scripts, it reads their combined files and saves the
+table of the pairs with at least one security in common to OVERLAP_FILE.
+"""
+
+from datetime import datetime
+import os
+import numpy as np
+import pandas as pd
+import tickers
+
+# the combined files of the issuer scripts, xlsx, csv or a parquet folder
+HOLDINGS_FILES = [r'iShares\BlackRock - iShares.xlsx',
+                  r'beta-shares\BetaShares.xlsx',
+                  r'state-street\All ETF Securities.xlsx',
+                  r'..\output\etfs\All ETF Securities.xlsx',
+                  r'Russell-Investments\Russell-Investments - ETF.xlsx']
+OVERLAP_FILE = r'..\output\ETF Overlap.csv'
+MAX_PAIRS = 5_000_000  # pairs of holdings worked on at a time, bounds the memory used
+
+OVERLAP_COLUMNS = ['etf ticker', 'Other etf ticker', 'Holdings', 'Other Holdings', 'Common Holdings',
+                   'Common Holdings %', 'Overlap Weight %']
+
+
+def text(values):
+    """ values as stripped text, None for the missing and empty ones """
+    values = values.astype(object).where(values.notna())
+    values = values.astype(str).str.strip().where(values.notna())
+    return values.where(values != '')
+
+
+def listing_countries(df):
+    """ The country each holding is listed in, the same for every issuer: the country of its exchange
+    code ('AU' and 'AT' are both Australia), else the file's Country (iShares' Location), else the code """
+    codes = text(df['Country Code']) if 'Country Code' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    countries = codes.map(tickers.EXCHANGE_COUNTRY)
+    if 'Country' in df.columns:
+        countries = countries.fillna(text(df['Country']))
+    return countries.fillna(codes)
+
+
+def security_keys(df):
+    """ Security Ticker with the country it is listed in ('BHP Australia'), the Security Name when there is
+    no ticker. iShares has no exchange codes, its Location gives the country """
+    name = df['Security Name'].astype(object) if 'Security Name' in df.columns else pd.Series(None, index=df.index)
+    if 'Security Ticker' not in df.columns:
+        return name
+    ticker = text(df['Security Ticker'])
+    countries = listing_countries(df)
+    ticker = ticker.where(countries.isna(), ticker + ' ' + countries.astype(str))
+    return ticker.fillna(name)
+
+
+def weight_matrix(df):
+    """ The ETF x security matrix of the weights in compressed sparse column form
+    Returns etfs, securities, indptr, indices, weights: the ETFs holding security s
+    are indices[indptr[s]:indptr[s + 1]] (in order) with weights at the same positions """
+    rows = pd.DataFrame({'etf': df['etf ticker'].astype(str), 'security': security_keys(df),
+                         'weight': pd.to_numeric(df['Weight %'], errors='coerce').fillna(0).astype('float64')})
+    rows = rows.dropna(subset=['security'])
+    etf_codes, etfs = pd.factorize(rows['etf'], sort=True)
+    security_codes, securities = pd.factorize(rows['security'].astype(str))
+    # a security listed more than once in an ETF is one entry of their total
+    entries = pd.Series(rows['weight'].to_numpy()).groupby([security_codes, etf_codes]).sum()
+    column = entries.index.get_level_values(0).to_numpy()
+    indices = entries.index.get_level_values(1).to_numpy()
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(column, minlength=len(securities)))])
+    return etfs, securities, indptr, indices, entries.to_numpy()
+
+
+def column_chunks(indptr, max_pairs=MAX_PAIRS):
+    """ Yield (start, stop) ranges of columns with at most max_pairs pairs of entries in each
+    A column with more pairs than that is a range of its own """
+    held = np.diff(indptr)
+    pairs = np.cumsum(held * (held - 1) // 2)
+    start = 0
+    while start < len(held):
+        done = pairs[start - 1] if start else 0
+        stop = max(int(np.searchsorted(pairs, done + max_pairs, side='right')), start + 1)
+        yield start, stop
+        start = stop
+
+
+def column_pairs(indptr, start, stop):
+    """ The positions (left, right) of every pair of entries in the same column, for the columns start to stop """
+    positions = np.arange(indptr[start], indptr[stop])
+    column_end = np.repeat(indptr[start + 1:stop + 1], np.diff(indptr[start:stop + 1]))
+    after = column_end - positions - 1  # entries after each one in its column, the ones it pairs with
+    left = np.repeat(positions, after)
+    first_pair = np.repeat(np.cumsum(after) - after, after)
+    return left, left + np.arange(len(left)) - first_pair + 1
+
+
+def overlaps(df, max_pairs=MAX_PAIRS):
+    """ The table of every pair of ETFs of the combined holdings with a security in common, both ways round """
+    etfs, securities, indptr, indices, weights = weight_matrix(df)
+    n = len(etfs)
+    common = np.zeros(n * n, dtype='int64')
+    overlap = np.zeros(n * n)
+    for start, stop in column_chunks(indptr, max_pairs):
+        left, right = column_pairs(indptr, start, stop)
+        cells = indices[left] * n + indices[right]  # the ETF codes are in order in a column, upper triangle only
+        common += np.bincount(cells, minlength=n * n)
+        overlap += np.bincount(cells, weights=np.minimum(weights[left], weights[right]), minlength=n * n)
+
+    cells = np.flatnonzero(common)
+    etf, other = np.divmod(cells, n)
+    etf, other = np.concatenate([etf, other]), np.concatenate([other, etf])
+    holdings = np.bincount(indices, minlength=n)
+    pair_common = np.tile(common[cells], 2)
+    table = pd.DataFrame({'etf ticker': etfs[etf], 'Other etf ticker': etfs[other],
+                          'Holdings': holdings[etf], 'Other Holdings': holdings[other],
+                          'Common Holdings': pair_common,
+                          'Common Holdings %': (100 * pair_common / holdings[etf]).round(2),
+                          'Overlap Weight %': np.tile(overlap[cells], 2).round(4)}, columns=OVERLAP_COLUMNS)
+    return table.sort_values(['etf ticker', 'Overlap Weight %'], ascending=[True, False], ignore_index=True)
+
+
+def common_securities(holdings):
+    """ Log lines of the securities each pair of files has in common, by their keys
+    none in common for two issuers of the same market means their keys don't match """
+    keys = {file_name: set(security_keys(df).dropna()) for file_name, df in holdings.items()}
+    names = list(keys)
+    return [f'{name} and {other} have {len(keys[name] & keys[other])} securities in common'
+            for n, name in enumerate(names) for other in names[n + 1:]]
+
+
+def read_holdings(file_name):
+    """ A combined holdings file as saved by the issuer scripts """
+    if os.path.isdir(file_name):
+        return pd.read_parquet(file_name)
+    if file_name.lower().endswith('.csv'):
+        return pd.read_csv(file_name)
+    return pd.read_excel(file_name, engine='openpyxl')
+
+
+if __name__ == "__main__":
+    start = datetime.now()
+    all_holdings = {}
+    for file_name in HOLDINGS_FILES:
+        if not os.path.exists(file_name):
+            print(f'{file_name} not found, skipping it')
+            continue
+        all_holdings[file_name] = read_holdings(file_name)
+        print(f'Read {file_name} size {all_holdings[file_name].shape}')
+    for line in common_securities(all_holdings):
+        print(line)
+    if all_holdings:
+        read_time = datetime.now()
+        table = overlaps(pd.concat(all_holdings.values(), ignore_index=True))
+        table.to_csv(OVERLAP_FILE, index=False)
+        print(f'Saved {OVERLAP_FILE} size {table.shape}, the overlaps took '
+              f'{(datetime.now() - read_time).total_seconds():.1f} seconds')
+    m, s = divmod((datetime.now() - start).seconds, 60)
+    print(f'This took {m} minutes, {s} seconds')
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Read several sheets of a workbook with one open
+
+pd.read_excel opens, unzips and parses the workbook again on every call, so
+reading six sheets of an ASX monthly statistics workbook one by one opened it
+six times. read_sheets opens it once and reads all the wanted sheets from that.
+The calamine engine (Rust, pip install python-calamine) is used when it is
+installed, else openpyxl in read-only mode.
+"""
+
+import pandas as pd
+
+try:
+    import python_calamine  # noqa: F401
+    ENGINE = 'calamine'
+except ImportError:
+    ENGINE = 'openpyxl'
+
+
+def read_sheets(file_name, wanted, **kwargs):
+    """ Open the workbook once and read every sheet wanted(sheet_name) is true for
+    kwargs are passed on to the sheet reader (e.g. skiprows, usecols, dtype).
+    Returns all the sheet names in the workbook and a dict sheet name -> frame """
+    with pd.ExcelFile(file_name, engine=ENGINE) as xl:
+        sheet_names = xl.sheet_names
+        chosen = [sheet for sheet in sheet_names if wanted(sheet)]
+        frames = xl.parse(sheet_name=chosen, **kwargs) if chosen else {}
+    return sheet_names, frames
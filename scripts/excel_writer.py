@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Write the combined files with a streaming xlsx writer
+
+df.to_excel builds the whole workbook in memory before it writes a byte of
+it, which takes minutes for a few hundred thousand rows. write_xlsx streams
+the frame into the sheet a block of rows at a time with xlsxwriter in
+constant_memory mode (pip install xlsxwriter), or openpyxl's write only mode
+without it, so memory stays flat. save writes the xlsx and the csv of a frame
+at the same time, in two threads.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+CHUNK_ROWS = 10000  # rows converted and written at a time
+
+
+def row_blocks(df, chunk_rows=CHUNK_ROWS):
+    """ Yield the rows of df as tuples of python values, None for the missing ones, a block at a time """
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows].astype(object)
+        yield chunk.where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def write_xlsx(df, file_name, sheet_name='Sheet1', freeze_panes=(1, 0)):
+    """ Save df to the sheet sheet_name of a new xlsx file, header in the first row, like
+    df.to_excel(file_name, sheet_name=sheet_name, index=False, freeze_panes=freeze_panes) """
+    header = [str(col) for col in df.columns]
+    if xlsxwriter is not None:
+        # the frame's text is data: no formulas, links or numbers made of it
+        wb = xlsxwriter.Workbook(file_name, {'constant_memory': True, 'strings_to_formulas': False,
+                                             'strings_to_urls': False, 'strings_to_numbers': False,
+                                             'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+        ws = wb.add_worksheet(sheet_name)
+        ws.freeze_panes(*freeze_panes)
+        ws.write_row(0, 0, header)
+        row = 1
+        for block in row_blocks(df):
+            for values in block:
+                ws.write_row(row, 0, values)
+                row += 1
+        wb.close()
+        return
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.freeze_panes = get_column_letter(freeze_panes[1] + 1) + str(freeze_panes[0] + 1)
+    ws.append(header)
+    for block in row_blocks(df):
+        for values in block:
+            ws.append(values)
+    wb.save(file_name)
+
+
+def save(df, xlsx_file, csv_file, sheet_name='Sheet1'):
+    """ Save df as xlsx_file and csv_file, both at the same time """
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        xlsx = pool.submit(write_xlsx, df, xlsx_file, sheet_name)
+        csv = pool.submit(df.to_csv, csv_file, index=False)
+        xlsx.result()
+        csv.result()
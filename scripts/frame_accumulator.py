@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Collect the frames of a run and put them together once at the end
+
+all_funds = all_funds.append(holdings) copies everything collected so far
+for every fund, so a run slows down as it goes (and DataFrame.append is gone
+from pandas 2). A FrameAccumulator keeps the frames as they are added, with
+the union of their columns in the order they first appear, and concatenates
+them once when frame() is called. Past SPILL_BYTES in memory the frames
+collected so far are written to a temporary file and read back by frame().
+"""
+
+import os
+import tempfile
+import pandas as pd
+
+SPILL_BYTES = 512 * 1024 * 1024  # frames held in memory before they are written to disk
+
+
+class FrameAccumulator:
+    """ Frames added one at a time, concatenated once """
+
+    def __init__(self, spill_bytes=SPILL_BYTES):
+        self.spill_bytes = spill_bytes
+        self.frames = []  # frames in memory
+        self.frames_bytes = 0
+        self.spilled = []  # temporary files with the frames written to disk, in order
+        self.spill_dir = None
+        self.columns = {}  # union of the columns of all the frames, in order, as dict keys
+        self.rows = 0
+
+    def add(self, df):
+        """ Add the frame, None and empty frames are ignored """
+        if df is None or df.empty:
+            return
+        self.frames.append(df)
+        self.columns.update(dict.fromkeys(df.columns))
+        self.rows += len(df)
+        self.frames_bytes += int(df.memory_usage(deep=True).sum())
+        if self.frames_bytes > self.spill_bytes:
+            self.spill()
+
+    def spill(self):
+        """ Write the frames in memory to a temporary file """
+        if not self.frames:
+            return
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.TemporaryDirectory(prefix='frames-')  # removed with the accumulator
+        file_name = os.path.join(self.spill_dir.name, f'{len(self.spilled)}.pkl')
+        pd.concat(self.frames, ignore_index=True).to_pickle(file_name)
+        self.spilled.append(file_name)
+        self.frames = []
+        self.frames_bytes = 0
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def empty(self):
+        return self.rows == 0
+
+    def parts(self):
+        """ Yield the frames added, in order and all with the union of their columns """
+        columns = list(self.columns)
+        for file_name in self.spilled:
+            yield pd.read_pickle(file_name).reindex(columns=columns)
+        for df in self.frames:
+            yield df.reindex(columns=columns)
+
+    def frame(self):
+        """ All the frames added as one, an empty frame if none were """
+        if self.empty:
+            return pd.DataFrame()
+        return pd.concat(self.parts(), ignore_index=True)
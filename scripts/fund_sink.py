@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Save each fund's holdings as soon as it is done, so a crashed run can resume
+
+The combined file is only written at the end of a run, if the run dies on
+fund 280 of 300 all of it is lost. A FundSink saves the holdings of every
+fund to its own file in the run's folder the moment the fund is done, and
+records it in the run journal (journal.jsonl, one line per finished fund,
+flushed to disk before save returns). Running again the same day opens the
+same folder: the funds in its journal are read back from their files instead
+of being fetched again, so a crash only costs the funds that were in flight.
+Once the combined file is saved the folder is removed and the next run
+starts afresh.
+"""
+
+from datetime import datetime
+import json
+import os
+import re
+import shutil
+from threading import Lock
+import pandas as pd
+
+JOURNAL_FILE = 'journal.jsonl'
+
+
+class FundSink:
+    """ The run's folder of finished funds and its journal """
+
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        os.makedirs(run_dir, exist_ok=True)
+        self.finished_funds = {}  # fund -> its holdings file, from the journal
+        journal_path = os.path.join(run_dir, JOURNAL_FILE)
+        line = '\n'
+        if os.path.exists(journal_path):
+            with open(journal_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # the last line of a run that died while writing it
+                    self.finished_funds[entry['fund']] = entry['file']
+        self.journal = open(journal_path, 'a')
+        if not line.endswith('\n'):
+            self.journal.write('\n')  # new entries start on a line of their own
+        self.lock = Lock()
+
+    def finished(self, fund):
+        """ True if the fund was finished by an earlier run today """
+        return fund in self.finished_funds
+
+    def holdings(self, fund):
+        """ The holdings saved for the fund """
+        return pd.read_pickle(os.path.join(self.run_dir, self.finished_funds[fund]))
+
+    def save(self, fund, df):
+        """ Save the fund's holdings and record the fund as finished, funds already finished are left as they are """
+        if fund in self.finished_funds:
+            return
+        file_name = re.sub(r'[^\w.-]', '_', str(fund)) + '.pkl'
+        file_path = os.path.join(self.run_dir, file_name)
+        df.to_pickle(file_path + '.tmp')
+        os.replace(file_path + '.tmp', file_path)  # never a half written file under the fund's name
+        with self.lock:
+            self.journal.write(json.dumps({'fund': fund, 'file': file_name, 'rows': len(df),
+                                           'finished': datetime.now().isoformat(timespec='seconds')}) + '\n')
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.finished_funds[fund] = file_name
+
+    def remove(self):
+        """ The run is complete, remove its folder """
+        self.journal.close()
+        shutil.rmtree(self.run_dir, ignore_errors=True)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Cache of each fund's last holdings, reused while its file doesn't change
+
+The issuers publish the holdings file once a day, but every run downloaded and
+parsed it again. For each fund the holdings frame made from the last download
+is saved with the file's SHA-256 and its ETag / Last-Modified. The next
+request sends those as If-None-Match / If-Modified-Since: when the issuer
+answers 304 Not Modified (not_modified), or sends the same file again
+(same_file), the saved frame is used instead of parsing again. This is the
+only copy of the parsed frames, change_state only keeps their hashes.
+A frame saved by another version of the parser (change_state.parser_version)
+is not reused, its fund is parsed again.
+"""
+
+from datetime import datetime
+from hashlib import sha256
+import json
+import os
+import re
+import pandas as pd
+
+CACHE_DIR = 'holdings-cache'
+
+cache_dir = CACHE_DIR  # None caches nothing
+parser = None  # version of the parser making the frames
+
+
+def load(dir_name=CACHE_DIR, version=None):
+    """ Use dir_name for the cache, create it if it doesn't exist, version is the parser's """
+    global cache_dir, parser
+    cache_dir = dir_name
+    parser = version
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+def cache_path(fund, ext):
+    safe_fund = re.sub(r'[^\w.-]', '_', fund)  # fund codes end up in file names
+    return os.path.join(cache_dir, f'{safe_fund}.{ext}')
+
+
+def validators(fund):
+    """ Return the saved {'etag':..., 'last_modified':..., 'sha256':...} of the fund, None if nothing
+    is cached or it was saved by another version of the parser """
+    if cache_dir is None or not os.path.exists(cache_path(fund, 'pkl')):
+        return None
+    try:
+        with open(cache_path(fund, 'json')) as f:
+            saved = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return saved if saved.get('parser') == parser else None
+
+
+def validator_headers(fund):
+    """ The If-None-Match / If-Modified-Since headers for the fund's next request """
+    saved = validators(fund)
+    headers = {}
+    if saved:
+        if saved.get('etag'):
+            headers['If-None-Match'] = saved['etag']
+        if saved.get('last_modified'):
+            headers['If-Modified-Since'] = saved['last_modified']
+    return headers
+
+
+def cached_holdings(fund):
+    """ Return the holdings saved with the fund's validators, None if there are none """
+    try:
+        return pd.read_pickle(cache_path(fund, 'pkl'))
+    except (FileNotFoundError, EOFError):
+        return None
+
+
+def not_modified(fund, res):
+    """ If the issuer answered 304 return the saved holdings of the fund, else None """
+    if res.status_code != 304 or validators(fund) is None:
+        return None
+    return cached_holdings(fund)
+
+
+def same_file(fund, body):
+    """ Return the saved holdings of the fund if body is the file they were made from, else None """
+    saved = validators(fund)
+    if saved is None or saved.get('sha256') != sha256(body).hexdigest():
+        return None
+    return cached_holdings(fund)
+
+
+def save(fund, res, df):
+    """ Save the holdings made from the response with the hash of its file and its validators """
+    if cache_dir is None:
+        return
+    try:
+        os.remove(cache_path(fund, 'json'))  # a frame without its entry is never reused
+    except FileNotFoundError:
+        pass
+    df.to_pickle(cache_path(fund, 'pkl') + '.tmp')
+    os.replace(cache_path(fund, 'pkl') + '.tmp', cache_path(fund, 'pkl'))
+    with open(cache_path(fund, 'json') + '.tmp', 'w') as f:
+        json.dump({'url': res.url, 'etag': res.headers.get('ETag'), 'last_modified': res.headers.get('Last-Modified'),
+                   'sha256': sha256(res.content).hexdigest(), 'parser': parser,
+                   'saved': datetime.now().isoformat(timespec='seconds')}, f, indent=1)
+    os.replace(cache_path(fund, 'json') + '.tmp', cache_path(fund, 'json'))
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+History of every fund's holdings in one SQLite file, a row per version
+
+The combined files are overwritten by every run, so there is no history to
+compare the holdings of an ETF over time. update loads a run's holdings into
+the holdings table of an SQLite file, where each (etf ticker, security) is
+stored once with the day it was first seen (valid_from) and the day it was
+gone (valid_to, NULL while it is still held). A new version is only added
+when its weight changes, so the file grows with the changes and not with the
+days times the rows. A security is its ticker with the country it is listed
+in, the same key as etf_overlap's.
+
+Loading a day again (a rerun the same day or --reparse) replaces what was
+loaded for it: the fund's versions from that day on are made again from the
+days it was loaded, which load_days keeps.
+
+holdings_on(etf ticker, day) and holders_of(security, first day, last day)
+answer the two questions of the comparison tool, both from an index.
+"""
+
+from datetime import date, datetime
+import json
+import sqlite3
+import pandas as pd
+from etf_overlap import security_keys
+
+WEIGHT_DECIMALS = 4  # weights that only differ past this decimal are the same version
+VERSION_COLUMNS = ['etf_ticker', 'security', 'security_name', 'issuer', 'weight', 'market_value']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS holdings (
+    etf_ticker TEXT NOT NULL,
+    security TEXT NOT NULL,  -- Security Ticker with its listing country ('BHP Australia'), the Security Name when there is none
+    security_name TEXT,
+    issuer TEXT,
+    weight REAL,
+    market_value REAL,  -- as of valid_from
+    valid_from TEXT NOT NULL,  -- YYYY-MM-DD
+    valid_to TEXT,  -- the first day it is no longer held, NULL while it is
+    PRIMARY KEY (etf_ticker, security, valid_from)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS holdings_by_security ON holdings (security, valid_from);
+CREATE INDEX IF NOT EXISTS holdings_held ON holdings (etf_ticker, security) WHERE valid_to IS NULL;
+CREATE TABLE IF NOT EXISTS load_days (
+    etf_ticker TEXT NOT NULL,
+    day TEXT NOT NULL,  -- a day the fund's holdings were loaded
+    PRIMARY KEY (etf_ticker, day)
+) WITHOUT ROWID;
+"""
+
+
+def connect(file_name):
+    """ Open the history file, create its tables if they aren't there """
+    con = sqlite3.connect(file_name)
+    con.executescript(SCHEMA)
+    return con
+
+
+def day_text(day):
+    if isinstance(day, (date, datetime)):
+        return day.strftime('%Y-%m-%d')
+    return pd.Timestamp(day).strftime('%Y-%m-%d')
+
+
+def text_column(df, col):
+    """ The column as python objects, None for the missing values and if there is no such column """
+    if col not in df.columns:
+        return None
+    return df[col].astype(object).where(df[col].notna(), None)
+
+
+def versions(df):
+    """ One row per etf ticker and security of the run's holdings, in the history's columns """
+    rows = pd.DataFrame({'etf_ticker': text_column(df, 'etf ticker'),
+                         'security_name': text_column(df, 'Security Name'),
+                         'issuer': text_column(df, 'Issuer'), 'security': security_keys(df)}, index=df.index)
+    for col, name in (('weight', 'Weight %'), ('market_value', 'Market Value')):
+        rows[col] = pd.to_numeric(df[name], errors='coerce').astype('float64') if name in df.columns else None
+    rows = rows.dropna(subset=['etf_ticker', 'security'])
+    rows['etf_ticker'] = rows['etf_ticker'].astype(str)
+    rows['security'] = rows['security'].astype(str).str.strip()
+    # a security listed more than once in a fund (e.g. cash lines) is one row of their total
+    rows = rows.groupby(['etf_ticker', 'security'], sort=False, as_index=False).agg(
+        security_name=('security_name', 'first'), issuer=('issuer', 'first'),
+        weight=('weight', lambda w: w.sum(min_count=1)), market_value=('market_value', lambda v: v.sum(min_count=1)))
+    rows['weight'] = rows['weight'].round(WEIGHT_DECIMALS)
+    return rows
+
+
+def same_weights(left, right):
+    """ True where the two weights are equal or both missing """
+    return (left == right) | (left.isna() & right.isna())
+
+
+def add_day(con, rows, day, funds):
+    """ Add the holdings of day to the history of funds loaded before it: only the changes
+    since their last day are written. Returns the counts of securities new, gone, changed, unchanged """
+    held = pd.read_sql_query('SELECT etf_ticker, security, weight AS held_weight FROM holdings '
+                             'WHERE valid_to IS NULL AND etf_ticker IN (SELECT value FROM json_each(?))',
+                             con, params=[json.dumps(funds)])
+    both = rows.merge(held, on=['etf_ticker', 'security'], how='outer', indicator=True)
+    new = both['_merge'] == 'left_only'
+    gone = both['_merge'] == 'right_only'
+    changed = (both['_merge'] == 'both') & ~same_weights(both['weight'], both['held_weight'])
+
+    # the versions that end today: the securities gone and the ones whose weight changed
+    ended = both.loc[gone | changed, ['etf_ticker', 'security']]
+    con.executemany('UPDATE holdings SET valid_to = ? WHERE etf_ticker = ? AND security = ? AND valid_to IS NULL',
+                    [(day, fund, security) for fund, security in ended.itertuples(index=False)])
+    insert(con, both.loc[new | changed, VERSION_COLUMNS].assign(valid_from=day, valid_to=None))
+    return int(new.sum()), int(gone.sum()), int(changed.sum()), int((~(new | gone | changed)).sum())
+
+
+def load_again(con, rows, day, funds):
+    """ Replace the holdings of day in the history of funds already loaded on or after it (a rerun
+    of the day or --reparse): the versions from day on are made again from the holdings of each day
+    the funds were loaded, the run's rows for day itself """
+    params = [json.dumps(funds), day]
+    old = pd.read_sql_query('SELECT * FROM holdings WHERE etf_ticker IN (SELECT value FROM json_each(?)) '
+                            'AND (valid_to IS NULL OR valid_to > ?)', con, params=params)
+    days = pd.read_sql_query('SELECT etf_ticker, day FROM load_days WHERE etf_ticker IN '
+                             '(SELECT value FROM json_each(?)) AND day >= ?', con, params=params)
+    days = pd.concat([days, pd.DataFrame({'etf_ticker': funds, 'day': day})]).drop_duplicates(ignore_index=True)
+    days = days.sort_values(['etf_ticker', 'day'], ignore_index=True)
+    days['n'] = days.groupby('etf_ticker').cumcount()
+    days['next_day'] = days.groupby('etf_ticker')['day'].shift(-1)
+
+    # the holdings of every day loaded after day as the history has them, and the run's for day
+    held = old.merge(days.loc[days['day'] != day, ['etf_ticker', 'day']], on='etf_ticker')
+    held = held[(held['valid_from'] <= held['day']) & (held['valid_to'].isna() | (held['valid_to'] > held['day']))]
+    held = pd.concat([held[VERSION_COLUMNS + ['day']], rows[VERSION_COLUMNS].assign(day=day)], ignore_index=True)
+    held = held.merge(days, on=['etf_ticker', 'day']).sort_values(['etf_ticker', 'security', 'n'], ignore_index=True)
+
+    # a version is a run of loaded days in a row with the same weight
+    previous = held.shift(1)
+    goes_on = ((held['etf_ticker'] == previous['etf_ticker']) & (held['security'] == previous['security'])
+               & (held['n'] == previous['n'] + 1) & same_weights(held['weight'], previous['weight']))
+    first, last = held[~goes_on], held[~goes_on.shift(-1, fill_value=False)]  # the rows starting and ending each run
+    versions = first[VERSION_COLUMNS].assign(valid_from=first['day'].to_numpy(), valid_to=last['next_day'].to_numpy())
+
+    con.execute('DELETE FROM holdings WHERE etf_ticker IN (SELECT value FROM json_each(?)) AND valid_from >= ?',
+                params)
+    con.execute('UPDATE holdings SET valid_to = ? WHERE etf_ticker IN (SELECT value FROM json_each(?)) '
+                'AND (valid_to IS NULL OR valid_to > ?)', [day, *params])
+    # a version of day with the weight the security had before it goes on with the version before
+    before = pd.read_sql_query('SELECT etf_ticker, security, weight AS before_weight FROM holdings '
+                               'WHERE etf_ticker IN (SELECT value FROM json_each(?)) AND valid_to = ?',
+                               con, params=params)
+    versions = versions.merge(before, on=['etf_ticker', 'security'], how='left', indicator=True)
+    goes_on = ((versions['valid_from'] == day) & (versions['_merge'] == 'both')
+               & same_weights(versions['weight'], versions['before_weight']))
+    con.executemany('UPDATE holdings SET valid_to = ? WHERE etf_ticker = ? AND security = ? AND valid_to = ?',
+                    [(valid_to, fund, security, day) for fund, security, valid_to
+                     in versions.loc[goes_on, ['etf_ticker', 'security', 'valid_to']].itertuples(index=False)])
+    insert(con, versions.loc[~goes_on, VERSION_COLUMNS + ['valid_from', 'valid_to']])
+
+
+def insert(con, versions):
+    """ Insert the versions, a frame of the VERSION_COLUMNS, valid_from and valid_to """
+    versions = versions.astype(object).where(versions.notna(), None)
+    con.executemany('INSERT INTO holdings (etf_ticker, security, security_name, issuer, weight, market_value, '
+                    'valid_from, valid_to) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', versions.itertuples(index=False))
+
+
+def update(df, file_name, as_of):
+    """ Load the run's holdings of as_of into the history file, return a line for the log
+    Only the funds in df are touched. The history of a fund already loaded on or after as_of
+    is made again from as_of on with the run's holdings for that day """
+    day = day_text(as_of)
+    rows = versions(df)
+    funds = rows['etf_ticker'].unique().tolist()
+    con = connect(file_name)
+    try:
+        with con:  # one transaction, all of the run or nothing
+            last_day = dict(con.execute('SELECT etf_ticker, MAX(day) FROM load_days WHERE etf_ticker IN '
+                                        '(SELECT value FROM json_each(?)) GROUP BY etf_ticker', [json.dumps(funds)]))
+            again = [fund for fund in funds if last_day.get(fund, '') >= day]
+            ahead = [fund for fund in funds if fund not in again]
+            new, gone, changed, unchanged = add_day(con, rows[rows['etf_ticker'].isin(ahead)], day, ahead)
+            if again:
+                load_again(con, rows[rows['etf_ticker'].isin(again)], day, again)
+            con.executemany('INSERT OR IGNORE INTO load_days (etf_ticker, day) VALUES (?, ?)',
+                            [(fund, day) for fund in funds])
+    finally:
+        con.close()
+    line = (f'History {file_name} as of {day}: {len(ahead)} funds, {new} securities added, '
+            f'{changed} weights changed, {gone} gone, {unchanged} unchanged')
+    if again:
+        line += f', {len(again)} funds already loaded on or after {day} made again from it: {", ".join(map(str, again))}'
+    return line
+
+
+def holdings_on(file_name, etf_ticker, day):
+    """ The holdings of the ETF on the day, as they were last loaded on or before it """
+    con = connect(file_name)
+    try:
+        return pd.read_sql_query(
+            'SELECT etf_ticker, security, security_name, issuer, weight, market_value, valid_from, valid_to '
+            'FROM holdings WHERE etf_ticker = ? AND valid_from <= ? AND (valid_to IS NULL OR valid_to > ?) '
+            'ORDER BY weight DESC', con, params=[etf_ticker, day_text(day), day_text(day)])
+    finally:
+        con.close()
+
+
+def holders_of(file_name, security, first_day, last_day):
+    """ The versions of the ETFs holding the security ('BHP Australia', see versions) at any time from first_day to last_day """
+    con = connect(file_name)
+    try:
+        return pd.read_sql_query(
+            'SELECT etf_ticker, security, security_name, issuer, weight, market_value, valid_from, valid_to '
+            'FROM holdings WHERE security = ? AND valid_from <= ? AND (valid_to IS NULL OR valid_to > ?) '
+            'ORDER BY etf_ticker, valid_from', con, params=[security, day_text(last_day), day_text(first_day)])
+    finally:
+        con.close()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Read only the holdings columns an issuer script keeps, with their types
+
+Each issuer script declares COLUMN_DTYPES: the columns of the issuer's file
+it uses (named as in the file, COLUMN_RE_MAPPING gives their new names) and
+the type of each, None to let pandas work it out. read passes these to the
+pandas reader as usecols and dtype, so the other columns are skipped instead
+of being parsed, typed and thrown away by keep_list.
+"""
+
+MIN_VALUES = 5  # rows with values in fewer columns than this are totals, notes or blank
+
+
+def usecols(column_dtypes):
+    """ usecols for the pandas readers: the columns in column_dtypes the file has """
+    return lambda col: col in column_dtypes
+
+
+def read(reader, source, column_dtypes, **kwargs):
+    """ reader(source) (pd.read_csv or pd.read_excel) of only the columns in column_dtypes
+    kwargs are passed on to reader. If a value in the file doesn't fit the type of its
+    column, the file is read again with the types left to pandas """
+    dtype = {col: t for col, t in column_dtypes.items() if t is not None}
+    start = source.tell()
+    try:
+        return reader(source, usecols=usecols(column_dtypes), dtype=dtype, **kwargs)
+    except (ValueError, TypeError):
+        source.seek(start)
+        return reader(source, usecols=usecols(column_dtypes), **kwargs)
+
+
+def drop_sparse_rows(df, min_values=MIN_VALUES):
+    """ Drop the total row and others mostly null
+    a row needs values in min_values columns, or in all but one when fewer are read """
+    return df.dropna(thresh=max(1, min(min_values, len(df.columns) - 1)))
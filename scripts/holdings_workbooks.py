@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Parse the State Street and ETF Securities holdings workbooks
+
+The parse functions of State_Street.py and etf_securities_holdings.py, kept
+in a module of their own so parse_pool can run them in worker processes:
+reading an xlsx holds the GIL, so in the fetch threads every fund waited for
+the others to be parsed. They only take the fund, the downloaded file and the
+script's column settings, don't log and return plain frames.
+"""
+
+from io import BytesIO
+import pandas as pd
+import holdings_schema
+import tickers
+
+
+def select_columns(df, fund, columns):
+    """ df with the etf ticker added and only the columns that are in columns, in their order """
+    df['etf ticker'] = fund
+    return df[[col for col in columns if col in df.columns]]
+
+
+def read_state_street(fund, res, column_dtypes, column_re_mapping, columns, skiprows):
+    """ The holdings of a State Street fund from its downloaded xlsx """
+    df = holdings_schema.read(pd.read_excel, BytesIO(res.content), column_dtypes, skiprows=skiprows)
+    df = holdings_schema.drop_sparse_rows(df)  # to drop the total row and others mostly null
+
+    # Splitting Bloomberg Ticker column into "Security Ticker", "Country Code" columns
+    if "Ticker" in df.columns:
+        df = tickers.add_ticker_columns(df, 'Ticker', sep='-')
+
+    # if we find any source columns in the rename dict, rename them
+    df = df.rename(columns=column_re_mapping)
+    df['Issuer'] = 'State Street'
+    return select_columns(df, fund, columns)
+
+
+def read_etf_securities(fund, res, column_dtypes, column_re_mapping, columns, skiprows):
+    """ The holdings of an ETF Securities fund from its downloaded xlsx """
+    df = holdings_schema.read(pd.read_excel, BytesIO(res.content), column_dtypes, skiprows=skiprows)
+    df = holdings_schema.drop_sparse_rows(df)  # to drop the total row and others mostly null
+
+    # Splitting Bloomberg Ticker column into "Security Ticker", "Country Code" columns
+    if "Bloomberg Ticker" in df.columns:
+        df = tickers.add_ticker_columns(df, 'Bloomberg Ticker', sep=' ')
+
+    # if we find any source columns in the rename dict, rename them
+    df = df.rename(columns=column_re_mapping)
+    return select_columns(df, fund, columns)
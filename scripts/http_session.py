@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Shared HTTP session for all the scrapers
+
+Calling requests.get directly opens a new connection, and does a new TLS
+handshake, for every request. All the scripts go through get/post here
+instead, which use one requests.Session with a keep-alive connection pool
+per host, sized to the number of funds fetched at the same time, and send the
+same headers and accepted compressions on every request. Each request waits
+for its host's adaptive rate limit (see rate_limiter) before it is sent.
+
+Connection errors, timeouts, 429 and 5xx answers are retried with exponential
+backoff and jitter, unless the host's circuit breaker is open (see
+circuit_breaker) or the run's deadline set with set_deadline has passed.
+
+get(url, hedge=True) hedges a request: if it takes longer than its host's 95th
+percentile response time an identical second request is sent and whichever
+answers first is used. At most MAX_HEDGES_IN_FLIGHT hedges run at a time.
+
+While a cassette is recording every response is saved, while one is replaying
+the responses come from it and nothing is sent (see cassette).
+
+download streams a large file (e.g. the ASX monthly workbooks) into a
+temporary file instead of holding it in memory.
+
+use_stand_in sends every request to a local stand-in of the issuer sites
+instead (see issuer_stand_in), everything else stays as if it went to the
+real host.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+import random
+import tempfile
+from threading import BoundedSemaphore, Lock
+import time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+import cassette
+import circuit_breaker
+import rate_limiter
+
+POOL_SIZE = 8  # connections kept alive per host, match it to the number of parallel fetches
+POOL_HOSTS = 16  # number of hosts to keep a connection pool for
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+              'Chrome/86.0.4240.75 Safari/537.36')
+
+RETRIES = 3  # extra attempts after a connection error, timeout, 429 or 5xx
+BACKOFF_SECONDS = 1.0  # the wait before retry n is random, up to BACKOFF_SECONDS * 2 ** n
+BACKOFF_MAX_SECONDS = 30.0
+
+DOWNLOAD_CHUNK = 1024 * 1024  # bytes read at a time by download
+
+HEDGE_PERCENTILE = 95  # a hedged request still running after this percentile of its host's latency is sent again
+MAX_HEDGES_IN_FLIGHT = 4
+HEDGE_THREADS = 32  # threads running hedged requests and their hedges
+
+session = None
+session_lock = Lock()
+deadline = None  # time.monotonic() after which no more requests are sent, None for no limit
+hedge_pool = None
+hedge_pool_lock = Lock()
+hedge_slots = BoundedSemaphore(MAX_HEDGES_IN_FLIGHT)
+hedges_sent = 0
+hedges_sent_lock = Lock()
+stand_in_url = None  # base url of issuer_stand_in.py, None sends the requests to the real hosts
+
+
+class DeadlineExceeded(requests.Timeout):
+    """ The run's deadline has passed, the request was not sent """
+
+
+def accept_encoding():
+    """ The compressions we can decode, brotli only if a brotli package is installed """
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        try:
+            import brotlicffi  # noqa: F401
+        except ImportError:
+            return 'gzip, deflate'
+    return 'gzip, deflate, br'
+
+
+def new_session(pool_size):
+    """ Create a session with keep-alive connection pools of pool_size per host """
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=pool_size)
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    s.headers.update({'User-Agent': USER_AGENT,
+                      'Accept': '*/*',
+                      'Accept-Encoding': accept_encoding(),
+                      'Connection': 'keep-alive'})
+    return s
+
+
+def configure(pool_size=POOL_SIZE):
+    """ (Re)create the shared session with pool_size connections per host """
+    global session
+    with session_lock:
+        if session is not None:
+            session.close()
+        session = new_session(pool_size)
+    return session
+
+
+def get_session():
+    """ Return the shared session, create it on first use """
+    global session
+    with session_lock:
+        if session is None:
+            session = new_session(POOL_SIZE)
+        return session
+
+
+def use_stand_in(base_url):
+    """ Send all requests to the stand-in at base_url, None sends them to the real hosts again """
+    global stand_in_url
+    stand_in_url = base_url.rstrip('/') if base_url else None
+
+
+def stand_in(url):
+    """ https://host/path?query -> {stand_in_url}/host/path?query when a stand-in is used """
+    if not stand_in_url:
+        return url
+    parts = urlparse(url)
+    return f'{stand_in_url}/{parts.netloc}{parts.path}' + (f'?{parts.query}' if parts.query else '')
+
+
+def set_deadline(seconds):
+    """ Stop sending requests seconds from now, None removes the deadline """
+    global deadline
+    deadline = None if seconds is None else time.monotonic() + seconds
+
+
+def time_left():
+    """ Seconds left until the deadline, None if there is no deadline """
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def limit_timeout(timeout, url):
+    """ Cut the request timeout so it doesn't run past the deadline """
+    left = time_left()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded(f'run deadline passed, not requesting {url}')
+    return left if timeout is None else min(timeout, left)
+
+
+def is_retry_status(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def backoff(attempt, res=None):
+    """ Sleep before the next attempt, honour a Retry-After (in seconds) from the host """
+    wait = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_SECONDS * 2 ** attempt))
+    if res is not None and res.headers.get('Retry-After', '').isdigit():
+        wait = max(wait, float(res.headers['Retry-After']))
+    left = time_left()
+    if left is not None:
+        wait = min(wait, max(left, 0))
+    time.sleep(wait)
+
+
+def send(method, url, **kwargs):
+    """ Send one attempt through the shared session, within its host's rate limit
+    The limiter gets the time to the response headers (res.elapsed), the same for the
+    streamed requests and the ones that read the whole body, so big files don't look slow """
+    limit = rate_limiter.for_host(urlparse(url).netloc.lower())
+    limit.acquire()
+    started = time.monotonic()
+    try:
+        res = get_session().request(method, stand_in(url), **kwargs)
+    except (requests.Timeout, requests.ConnectionError):  # timeouts, refused and reset connections
+        limit.release(time.monotonic() - started, throttled=True)
+        raise
+    except Exception:
+        limit.free()  # not the host's doing, e.g. an invalid url
+        raise
+    limit.release(res.elapsed.total_seconds(), throttled=rate_limiter.is_throttle_status(res.status_code),
+                  duration=time.monotonic() - started)  # the hedges wait for whole requests
+    return res
+
+
+def request(method, url, **kwargs):
+    """ Send the request, retrying connection errors, timeouts, 429 and 5xx
+    The last response is returned even if its status is still an error """
+    if cassette.replaying():
+        return cassette.replay(method, url, kwargs)
+    if cassette.recording():
+        kwargs = cassette.without_validators(kwargs)
+        res = send_with_retries(method, url, **kwargs)
+        cassette.record(method, url, kwargs, res)
+        return res
+    return send_with_retries(method, url, **kwargs)
+
+
+def send_with_retries(method, url, **kwargs):
+    breaker = circuit_breaker.for_host(urlparse(url).netloc.lower())
+    timeout = kwargs.pop('timeout', None)
+    for attempt in range(RETRIES + 1):
+        breaker.check()
+        try:
+            res = send(method, url, timeout=limit_timeout(timeout, url), **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            breaker.failure()
+            if attempt == RETRIES:
+                raise
+            backoff(attempt)
+            continue
+        except Exception:
+            breaker.failure()  # ends a half open breaker's trial too, else the host would stay open
+            raise
+        if not is_retry_status(res.status_code):
+            breaker.success()
+            return res
+        breaker.failure()
+        if attempt == RETRIES:
+            return res
+        res.close()  # give the connection back before trying again
+        backoff(attempt, res)
+
+
+def get_hedge_pool():
+    global hedge_pool
+    with hedge_pool_lock:
+        if hedge_pool is None:
+            hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix='hedge')
+        return hedge_pool
+
+
+def hedged_request(method, url, **kwargs):
+    """ request(), sending a second identical request if the first one is slower than
+    its host usually is. The first successful answer wins, the other one is closed """
+    global hedges_sent
+    delay = rate_limiter.for_host(urlparse(url).netloc.lower()).latency_percentile(HEDGE_PERCENTILE)
+    if delay is None:  # don't know yet what slow is for this host
+        return request(method, url, **kwargs)
+    pool = get_hedge_pool()
+    first = pool.submit(request, method, url, **kwargs)
+    done, _ = wait([first], timeout=delay)
+    if done or not hedge_slots.acquire(blocking=False):
+        return first.result()
+    with hedges_sent_lock:  # hedges are sent from every fetch thread
+        hedges_sent += 1
+    hedge = pool.submit(request, method, url, **kwargs)
+    hedge.add_done_callback(lambda f: hedge_slots.release())
+    pending = {first, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            if f.exception() is None:
+                loser = hedge if f is first else first
+                loser.add_done_callback(close_response)  # gives its connection back, at once if it is done
+                return f.result()
+    return first.result()  # both failed, raise the first request's error
+
+
+def close_response(future):
+    """ Done callback closing the response of the request that lost a hedge """
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def get(url, hedge=False, **kwargs):
+    """ requests.get through the shared session, hedge=True hedges slow requests """
+    if hedge:
+        return hedged_request('GET', url, **kwargs)
+    return request('GET', url, **kwargs)
+
+
+def download(url, **kwargs):
+    """ Stream url into a temporary file and return its name, only DOWNLOAD_CHUNK bytes
+    are held in memory at a time. The caller deletes the file when done with it.
+    Raises requests.HTTPError if the answer is an error status """
+    res = request('GET', url, stream=True, **kwargs)
+    try:
+        res.raise_for_status()
+        fd, file_name = tempfile.mkstemp(suffix=os.path.splitext(urlparse(url).path)[1])
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in res.iter_content(DOWNLOAD_CHUNK):
+                    f.write(chunk)
+        except BaseException:
+            os.remove(file_name)
+            raise
+    finally:
+        res.close()
+    return file_name
+
+
+def post(url, data=None, **kwargs):
+    """ requests.post through the shared session """
+    return request('POST', url, data=data, **kwargs)
@@ -23,11 +23,27 @@ Change Log
 """
 
 from datetime import datetime
-from io import StringIO
 import os
-import requests
+import sys
+import cassette
+import change_state
+import circuit_breaker
+import compaction
+import csv_sections
+import excel_writer
+import http_session
+import parquet_output
+import payload_archive
+import rate_limiter
+import holdings_cache
+import holdings_history
+import holdings_schema
+import link_cache
+import link_finder
 import pandas as pd
-from bs4 import BeautifulSoup
+from frame_accumulator import FrameAccumulator
+from fund_runner import fetch_in_order, host_of
+from fund_sink import FundSink
 
 # CONSTANTS Configurations
 INVESTMENT_PRODUCTS_LIST = 'iShares List.xlsx'
@@ -36,8 +52,25 @@ OUTPUT_DIR = r'iShares'
 LOGS_DIR = r'iShares'
 
 TIME_OUT = 30  # timeout for all web requests, else may hang
+MAX_WORKERS = 8  # funds fetched in parallel, 1 fetches them one at a time
+RUN_DEADLINE = 20 * 60  # seconds the run may spend on web requests, the funds left after that fail
+HEDGE_SLOW_REQUESTS = False  # True sends a second request when one is slower than 95% of its host's
 
 OUTPUT_I_SHARES_FILE = f'{OUTPUT_DIR}\\BlackRock - iShares.xlsx'
+SAVE_PARQUET = True  # also save the combined file as parquet in PARQUET_DIR (needs pyarrow)
+PARQUET_DIR = f'{OUTPUT_DIR}\\parquet'
+HISTORY_FILE = f'{OUTPUT_DIR}\\holdings-history.sqlite'  # every version of each fund's holdings, None keeps none
+RUNS_DIR = f'{OUTPUT_DIR}\\runs'  # each day's finished funds and run journal, until the run is complete
+LINK_CACHE_FILE = f'{OUTPUT_DIR}\\holdings-links.json'  # holdings file link found for each fund
+HOLDINGS_CACHE_DIR = f'{OUTPUT_DIR}\\holdings-cache'  # last holdings of each fund with its file's hash and ETag
+CASSETTE_MODE = None  # 'record' saves every web request and response to CASSETTE_FILE, 'replay' serves them from it
+CASSETTE_FILE = f'{OUTPUT_DIR}\\cassette.zip'
+RAW_ARCHIVE_DIR = f'{OUTPUT_DIR}\\raw'  # every holdings file downloaded, compressed, to rebuild past days
+REPARSE_DAYS = None  # e.g. ('20210901', '20210930') rebuilds those days from RAW_ARCHIVE_DIR, no web requests
+REPARSE_DIR = f'{OUTPUT_DIR}\\reparsed'  # the rebuilt days as xlsx, when pyarrow is not installed for PARQUET_DIR
+CHANGE_STATE_DIR = f'{OUTPUT_DIR}\\change-state'  # hash of each fund's last holdings, to tell the unchanged
+CHANGES_FILE = f'{OUTPUT_DIR}\\changes.csv'  # the funds of the last run, new, changed or unchanged, for incremental loads
+STAND_IN_URL = None  # e.g. 'http://127.0.0.1:8765' sends every request to issuer_stand_in.py instead
 
 # After renaming columns, keep only these ones in the final file
 # Note that this also determines the column order in the Excel file.
@@ -51,6 +84,10 @@ COLUMN_RE_MAPPING = {'Name': 'Security Name',
                      # ,'Sector':'Sector'
                      }
 
+# the columns read from the holdings file, as named in it, and their types (None: left to pandas)
+COLUMN_DTYPES = {'Ticker': str, 'Name': str, 'Weight (%)': 'float64', 'Market Value': 'float64',
+                 'Location': str, 'Rate': None, 'Maturity date': None}
+
 
 def create_dir(dirName):
     """ Create if it doesn't exist """
@@ -79,45 +116,56 @@ def keep_list(k, all):
     return intersection
 
 
-def is_get_holdings(fund, link):
-    """ BlackRock iShares """
+def is_find_file_url(fund, link):
+    """ Scrape the landing page for the Download Holdings link, None if it isn't there """
     try:
-        res = requests.get(link, timeout=TIME_OUT)  # pull the containing page
+        # read the containing page only up to the tag with the link text
+        tag = link_finder.find_element(link, link_finder.link_text('Download Holdings'),
+                                       timeout=TIME_OUT, hedge=HEDGE_SLOW_REQUESTS)
     except  Exception as e:
         writelog(f'{fund}\tCould not get the containing page {link}: {e}')
-        return pd.DataFrame()
-    soup = BeautifulSoup(res.content, 'lxml')  # parse
-    tag = soup.find('a', string='Download Holdings')  # find the tag with the link text
-    if not tag:
+        return None
+    if tag is None:
         writelog(f'{fund}\tCould not find the spreadsheet link in\t{link}')
-        return pd.DataFrame()
+        return None
+    return BASE_URL + tag.get('href')  # add the relative link
+
 
-    file_url = BASE_URL + tag['href']  # add the relative link
+def is_get_holdings(fund, link, issuer):
+    """ BlackRock iShares """
     try:
-        result = requests.get(file_url, timeout=TIME_OUT)  # get the file
+        # the saved file link is used if it still works, else the landing page is scraped again
+        result = link_cache.get_file(fund, link, is_find_file_url, timeout=TIME_OUT, hedge=HEDGE_SLOW_REQUESTS,
+                                     headers=holdings_cache.validator_headers(fund))  # get the file
     except  Exception as e:
-        writelog(f'{fund}\tCould not get the spreadsheet {file_url}: {e}')
+        writelog(f'{fund}\tCould not get the spreadsheet for {link}: {e}')
         return pd.DataFrame()
-
-    # set skiprows 9 for all the holding
+    if result is None:
+        return pd.DataFrame()
+    payload_archive.save(issuer, fund, start_day, result)  # kept to parse again with --reparse
+    cached = holdings_cache.not_modified(fund, result)  # same file as last time, no need to parse it
+    if cached is not None:
+        return cached
+    cached = holdings_cache.same_file(fund, result.content)  # same file as the last run, no need to parse it
+    if cached is not None:
+        return cached
+    df = is_parse_holdings(fund, result)
+    holdings_cache.save(fund, result, df)  # reused on a 304 Not Modified or the same file
+    return df
+
+
+def is_parse_holdings(fund, result):
+    """ The holdings of the fund from its downloaded file """
+    # the header is the last "Ticker" line after the 9 preamble lines, some funds repeat it for each section
     first_skip_rows = 9
-
-    df = pd.read_csv(StringIO(result.text), skiprows=first_skip_rows)
-    df = df.dropna(thresh=5)  # to drop the total row and others mostly null
-
-    ticker_header_list = df.index[df['Ticker'] == 'Ticker'].tolist()  # df.loc[df['Ticker'].isin(['Ticker'])]
-    if ticker_header_list:
-        # exists number of header if there exists multiple Ticker columns in the holding is one (1)
-        exists_header_num = 1  # this header number must be added into new skiprows
-        index = ticker_header_list[len(ticker_header_list) - 1]  # take Header from the last index
-        modified_skip_rows = first_skip_rows + index + exists_header_num  # add the number of header count to new skip rows
-        df = pd.read_csv(StringIO(result.text), skiprows=modified_skip_rows)
-        df = df.dropna(thresh=5)  # to drop the total row and others mostly null
+    csv = csv_sections.from_last_header(result.text, 'Ticker', skip_lines=first_skip_rows)
+    if csv is None:
+        csv = csv_sections.between_lines(result.text, first_skip_rows, 0)
+    df = holdings_schema.read(pd.read_csv, csv, COLUMN_DTYPES, thousands=',')
+    df = holdings_schema.drop_sparse_rows(df)  # to drop the total row and others mostly null
 
     # if we find any source columns in the rename dict, rename them
-    for col in COLUMN_RE_MAPPING:
-        if col in list(df):
-            df.rename(columns={col: COLUMN_RE_MAPPING[col]}, inplace=True)
+    df = df.rename(columns=COLUMN_RE_MAPPING)
 
     if save_individual_files:
         save_file = f'{OUTPUT_DIR}\\{start.strftime("%Y%m%d")}_{fund}.xlsx'
@@ -137,6 +185,19 @@ print("======================================================================")
 
 create_dir(OUTPUT_DIR)
 create_dir(LOGS_DIR)
+http_session.configure(pool_size=MAX_WORKERS)  # one kept-alive connection per parallel fetch
+http_session.set_deadline(RUN_DEADLINE)
+cassette.start(CASSETTE_MODE, CASSETTE_FILE)
+http_session.use_stand_in(STAND_IN_URL)
+# a cassette replay or the stand-in are not the issuers' files of today, keep them out of the caches and the history
+offline_run = cassette.replaying() or bool(STAND_IN_URL)
+# saved frames of other versions of the parser are parsed again
+parser_version = change_state.parser_version(is_parse_holdings, COLUMN_DTYPES, COLUMN_RE_MAPPING, COLUMN_TO_DISPLAY)
+link_cache.load(None if offline_run else LINK_CACHE_FILE)
+holdings_cache.load(None if offline_run else HOLDINGS_CACHE_DIR, parser_version)
+payload_archive.load(None if offline_run else RAW_ARCHIVE_DIR)
+change_state.load(None if offline_run else CHANGE_STATE_DIR)
+reparse_days = payload_archive.reparse_days(sys.argv[1:], REPARSE_DAYS)  # --reparse FIRST_DAY [LAST_DAY]
 
 start = datetime.now()
 start_day = start.strftime("%Y%m%d")
@@ -146,44 +207,98 @@ logfile = f'{start_day}_{os.path.basename(__file__).split(".")[0]}.log'
 lf = open(f'{LOGS_DIR}\\{logfile}', 'a')
 lf.write('\n' + '-' * 75 + '\n')
 
-all_funds = pd.DataFrame()  # empty data frame to add to
-
 fund_list = pd.read_excel(INVESTMENT_PRODUCTS_LIST, engine="openpyxl", )
 fund_list.fillna('', inplace=True)  # convert NA to empty string (from float)
 
+if reparse_days:  # rebuild those days from the archive instead of fetching today's holdings
+    create_dir(REPARSE_DIR)
+    writelog(f'Rebuilding the days from {reparse_days[0]} to {reparse_days[1]} from {RAW_ARCHIVE_DIR}')
+    categories = dict(zip(fund_list['ASX Code'], fund_list['ETF Category']))
+    for line in payload_archive.rebuild(*reparse_days, is_parse_holdings, categories, OUTPUT_I_SHARES_FILE,
+                                        'BlackRock_iShares', REPARSE_DIR, PARQUET_DIR if SAVE_PARQUET else None,
+                                        HISTORY_FILE, max_workers=MAX_WORKERS):
+        writelog(line)
+    m, s = divmod((datetime.now() - start).seconds, 60)
+    writelog(f'This took {m} minutes, {s} seconds')
+    lf.close()
+    sys.exit()
+
+funds_holdings = FrameAccumulator()  # the holdings of every fund, put together once at the end
+run_dir = f'{RUNS_DIR}\\{start_day}' + ('-offline' if offline_run else '')
+run_sink = FundSink(run_dir)  # funds finished by a run today that crashed are not fetched again
+
 # ---------- Main Loop ---------- #
 
-for i in range(len(fund_list)):
+
+def get_fund_holdings(i):
+    """ Fetch the holdings of row i of the fund list, None if the row is skipped """
     # take care - headings are case sensitive
     fund = fund_list.loc[i, 'ASX Code']
     # etf_cat = fund_list.loc[i,'ETF Category']
     link = fund_list.loc[i, 'Link']
     issuer = fund_list.loc[i, 'Issuer']
     writelog(f'{fund}\t{issuer}\tStarting...')
+    if run_sink.finished(fund):
+        writelog(f'{fund}\t{issuer}\tFinished by an earlier run today, reading its saved holdings')
+        return run_sink.holdings(fund)
     if len(link) > 4:  # skip NA
         if issuer.lower().startswith('ishares'):
-            holdings = is_get_holdings(fund, link)
-
+            holdings = is_get_holdings(fund, link, issuer)
         else:
             writelog(f'{fund}\t{issuer}\tDid not recognise this issuer')
-
-        # if the function returned an empty dataframe, skip
-        if len(holdings) == 0:
-            writelog(f'{fund}\t{issuer}\tFailed to get holdings')
-        else:
-            # writelog(f'{fund}\t{issuer}\tAdding {len(holdings)} rows')
+            return pd.DataFrame()
+        if len(holdings) > 0:
             holdings['ETF Category'] = fund_list.loc[i, 'ETF Category']
             holdings['Issuer'] = fund_list.loc[i, 'Issuer']
-            all_funds = all_funds.append(holdings)
-            # all_funds.to_excel(OUTPUT_I_SHARES_FILE, sheet_name='ETF', index=False, freeze_panes=(1,0))
-            # write out the combined DF every time in case of crash
+            run_sink.save(fund, holdings)  # on disk as soon as it is done, in the thread that fetched it
+        return holdings
+    writelog(f'{fund}\t{issuer}\tSKIPPING, not a valid link')
+    return None
+
+
+# the funds are fetched in parallel but the results come back in fund list order
+fund_rows = range(len(fund_list))
+all_holdings = fetch_in_order(fund_rows, get_fund_holdings, host=lambda i: host_of(fund_list.loc[i, 'Link']),
+                              max_workers=MAX_WORKERS)
+for i, holdings in zip(fund_rows, all_holdings):
+    if holdings is None:  # skipped, not a valid link
+        continue
+    fund = fund_list.loc[i, 'ASX Code']
+    issuer = fund_list.loc[i, 'Issuer']
+    # if the function returned an empty dataframe, skip
+    if len(holdings) == 0:
+        writelog(f'{fund}\t{issuer}\tFailed to get holdings')
     else:
-        writelog(f'{fund}\t{issuer}\tSKIPPING, not a valid link')
+        # writelog(f'{fund}\t{issuer}\tAdding {len(holdings)} rows')
+        if change_state.mark(fund, holdings, start_day) == change_state.UNCHANGED:
+            writelog(f'{fund}\t{issuer}\tUnchanged since the last run')
+        funds_holdings.add(holdings)
+        # all_funds.to_excel(OUTPUT_I_SHARES_FILE, sheet_name='ETF', index=False, freeze_panes=(1,0))
+        # write out the combined DF every time in case of crash
 
 # Saving all at the end - riskier
-all_funds.to_excel(OUTPUT_I_SHARES_FILE, sheet_name='BlackRock_iShares', index=False, freeze_panes=(1, 0))
-print('\n')
-writelog(f'Saved the combined file {OUTPUT_I_SHARES_FILE} size {all_funds.shape}')
+all_funds = funds_holdings.frame()
+all_funds, size_before, size_after = compaction.compact(all_funds)  # categoricals and floats
+writelog(compaction.report(size_before, size_after))
+if SAVE_PARQUET:
+    writelog(parquet_output.write(all_funds, PARQUET_DIR, ['Issuer'], as_of=start))  # by Issuer and as of date
+if HISTORY_FILE and not offline_run:
+    writelog(holdings_history.update(all_funds, HISTORY_FILE, start))  # only the changes add rows
+if change_state.all_unchanged() and os.path.exists(OUTPUT_I_SHARES_FILE):
+    writelog(f'No fund changed since the last run, {OUTPUT_I_SHARES_FILE} is left as it is')
+else:
+    excel_writer.write_xlsx(all_funds, OUTPUT_I_SHARES_FILE, sheet_name='BlackRock_iShares')  # streamed, in constant memory
+    print('\n')
+    writelog(f'Saved the combined file {OUTPUT_I_SHARES_FILE} size {all_funds.shape}')
+change_state.write_changes(CHANGES_FILE)  # new, changed and unchanged funds for the incremental loads
+change_state.save()
+run_sink.remove()  # the combined file is saved, the next run starts afresh
+
+# ------ Print the request rate each host settled on and the hosts found down ----------
+for line in change_state.report() + rate_limiter.report() + circuit_breaker.report():
+    writelog(line)
+if HEDGE_SLOW_REQUESTS:
+    writelog(f'Hedged {http_session.hedges_sent} slow requests')
 
 # ------ Print the time taken and Exit ----------
 end = datetime.now()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Local stand-in for the issuer web sites, for load testing the scrapers
+
+Serves pages and files shaped like the real ones:
+  www.blackrock.com      iShares landing page with a "Download Holdings" link,
+                         holdings CSV with the 9 line preamble
+  www.betashares.com.au  landing page with a Holdings.csv link,
+                         holdings CSV with the 6 line header and 5 line footer
+  www.ssga.com           daily holdings xlsx with 4 rows above the header
+  www2.asx.com.au        funds statistics page and the monthly multi-sheet workbooks
+Every holdings file has --rows rows. --latency, --slow-rate and --error-rate
+add response time, slow outliers and 503 errors.
+
+The scripts are pointed at it with STAND_IN_URL, http_session then sends
+https://www.ssga.com/au/... to http://127.0.0.1:8765/www.ssga.com/au/... and
+the first part of the path tells the stand-in which issuer to play.
+--fund-lists DIR writes iShares / BetaShares / State Street fund lists with
+--funds funds each, to run the scripts at many times today's fund count.
+
+Run: python issuer_stand_in.py --rows 50000 --latency 0.3 --error-rate 0.02
+"""
+
+import argparse
+from datetime import date
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+import csv
+import os
+import random
+import time
+from urllib.parse import parse_qs, urlparse
+from openpyxl import Workbook
+
+PORT = 8765
+ROWS = 200  # rows in every holdings file
+LATENCY = 0.0  # seconds added to every response
+SLOW_RATE = 0.0  # share of the responses that take SLOW_SECONDS more
+SLOW_SECONDS = 10.0
+ERROR_RATE = 0.0  # share of the responses that are 503 errors
+FUNDS = 300  # funds per issuer in the fund lists written by --fund-lists
+ASX_YEARS = 3  # years of monthly workbooks on the ASX funds statistics page
+
+ASX_SHEETS = ['ETP', 'LIC', 'REIT', 'MFSA', 'MFUND', 'INFRA']
+ASX_COLUMNS = ['ASX Code', 'Fund Name', 'Issuer', 'Category', 'FUM ($m)', 'Mkt Cap ($m)', 'Units on Issue',
+               'Value ($)', 'Volume', 'Trades', 'Management Fee (%)']
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+          'November', 'December']
+EXCHANGES = ['AT', 'US', 'LN', 'HK', 'JP', 'GR', 'FP', 'CN', 'KS', 'SW']
+SECTORS = ['Financials', 'Materials', 'Information Technology', 'Health Care', 'Energy', 'Industrials',
+           'Consumer Staples', 'Real Estate', 'Utilities', 'Communication']
+COUNTRIES = ['Australia', 'United States', 'United Kingdom', 'Hong Kong', 'Japan', 'Germany', 'France']
+
+settings = argparse.Namespace(rows=ROWS, latency=LATENCY, slow_rate=SLOW_RATE, error_rate=ERROR_RATE)
+
+
+def fund_codes(prefix, count):
+    return [f'{prefix}{n:03d}' for n in range(count)]
+
+
+def holdings_rows(fund, rows):
+    """ Made up holdings for the fund, the same every time for the same fund """
+    rnd = random.Random(fund)
+    weights = [rnd.random() for _ in range(rows)]
+    total = sum(weights)
+    for n, w in enumerate(weights):
+        ticker = f'{rnd.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ")}{n:05d}'
+        yield {'ticker': ticker,
+               'exchange': rnd.choice(EXCHANGES),
+               'name': f'{ticker} HOLDINGS LTD',
+               'sector': rnd.choice(SECTORS),
+               'country': rnd.choice(COUNTRIES),
+               'weight': round(100 * w / total, 6),
+               'shares': rnd.randint(100, 10 ** 7),
+               'price': round(rnd.uniform(0.5, 500), 4)}
+
+
+def csv_text(header, rows):
+    out = StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(header)
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+@lru_cache(maxsize=64)
+def ishares_csv(fund, rows):
+    preamble = [f'iShares {fund} ETF', f'Fund Holdings as of,"{date.today():%d/%b/%Y}"', 'Inception Date,"01/Jan/2015"',
+                'Shares Outstanding,"12,345,678.00"', 'Stock,"-"', 'Bond,"-"', 'Cash,"-"', 'Other,"-"', '\xa0']
+    header = ['Ticker', 'Name', 'Sector', 'Asset Class', 'Market Value', 'Weight (%)', 'Notional Value', 'Shares',
+              'Price', 'Location', 'Exchange', 'Currency', 'FX Rate', 'Market Currency']
+    body = ([h['ticker'], h['name'], h['sector'], 'Equity', f'{h["shares"] * h["price"]:,.2f}', h['weight'],
+             f'{h["shares"] * h["price"]:,.2f}', f'{h["shares"]:,}', h['price'], h['country'], 'ASX', 'AUD', 1.0,
+             'AUD'] for h in holdings_rows(fund, rows))
+    footer = '\xa0\n"The content contained herein is owned or licensed by BlackRock"\n'
+    return ('\n'.join(preamble) + '\n' + csv_text(header, body) + footer).encode('utf-8')
+
+
+@lru_cache(maxsize=64)
+def betashares_csv(fund, rows):
+    header_lines = [f'BetaShares {fund} ETF', 'Fund Holdings', f'As at {date.today():%d %B %Y}', '', 'Holdings', '']
+    header = ['Ticker', 'Name', 'Asset Class', 'Sector', 'Country', 'Weight (%)', 'Shares/Units (#)',
+              'Market Value (AUD)']
+    body = ([f'{h["ticker"]} {h["exchange"]}', h['name'], 'Equity', h['sector'], h['country'], h['weight'],
+             h['shares'], round(h['shares'] * h['price'], 2)] for h in holdings_rows(fund, rows))
+    footer_lines = ['Total,,,,,100.00,,', '', 'Source: BetaShares', 'Past performance is not an indicator',
+                    'of future performance.']
+    text = '\n'.join(header_lines) + '\n' + csv_text(header, body) + '\n'.join(footer_lines)
+    return text.encode('utf-8')
+
+
+def workbook_bytes(wb):
+    out = BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+@lru_cache(maxsize=64)
+def ssga_xlsx(fund, rows):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('holdings')
+    ws.append(['Fund Name:', f'SPDR {fund.upper()} Fund'])
+    ws.append(['Ticker Symbol:', fund.upper()])
+    ws.append(['Holdings:', f'As of {date.today():%d-%b-%Y}'])
+    ws.append([])
+    ws.append(['Name', 'Ticker', 'Identifier', 'SEDOL', 'Weight (%)', 'Sector', 'Shares Held', 'Local Price',
+               'Local Currency', 'Market Value', 'Country', 'Maturity date', 'Rate'])
+    for h in holdings_rows(fund, rows):
+        ws.append([h['name'], f'{h["ticker"]}-{h["exchange"]}', h['ticker'], f'B{h["shares"] % 999999:06d}',
+                   h['weight'], h['sector'], h['shares'], h['price'], 'AUD', round(h['shares'] * h['price'], 2),
+                   h['country'], None, None])
+    return workbook_bytes(wb)
+
+
+@lru_cache(maxsize=64)
+def asx_workbook(year, month, rows):
+    """ Monthly statistics workbook, a sheet per product type plus a notes sheet """
+    wb = Workbook(write_only=True)
+    notes = wb.create_sheet('Notes')
+    notes.append([f'ASX Investment Products Monthly Update - {MONTHS[month - 1]} {year}'])
+    rnd = random.Random(year * 100 + month)
+    for sheet in ASX_SHEETS:
+        ws = wb.create_sheet(f'{sheet} Funds')
+        ws.append([f'{sheet} - {MONTHS[month - 1]} {year}'])
+        ws.append([])
+        ws.append([f'{c}\n' if n == 4 else c for n, c in enumerate(ASX_COLUMNS)])
+        for n in range(rows):
+            ws.append([f'{sheet[:1]}{n:03d}', f'{sheet} Fund {n}', f'Issuer {n % 40}', rnd.choice(SECTORS),
+                       round(rnd.uniform(1, 5000), 2), round(rnd.uniform(1, 5000), 2), rnd.randint(10 ** 5, 10 ** 9),
+                       round(rnd.uniform(1, 10 ** 8), 2), rnd.randint(0, 10 ** 7), rnd.randint(0, 10 ** 5),
+                       round(rnd.uniform(0.05, 1.5), 2)])
+        ws.append(['Total', None, None, None, None])
+    return workbook_bytes(wb)
+
+
+def asx_statistics_page():
+    """ The funds statistics page, a tab per year with a table of monthly workbook links """
+    panels = []
+    this_year = date.today().year
+    for year in range(this_year, this_year - ASX_YEARS, -1):
+        links = ''.join(f'<tr><td><a href="/content/dam/asx/funds/{year}/{month:02d}.xlsx">'
+                        f'ASX Investment Products - {MONTHS[month - 1]} {year}</a></td></tr>'
+                        for month in range(12, 0, -1))
+        panels.append(f'<div class="cmp-tabs__tabpanel"><div id="multi-column-1"><table>{links}</table></div></div>')
+    return f'<html><body><div class="tabs-component">{"".join(panels)}</div></body></html>'.encode('utf-8')
+
+
+def landing_page(title, href, text):
+    filler = '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>' * 2000  # real pages are big
+    return (f'<html><head><title>{title}</title></head><body>{filler}'
+            f'<a class="icon-xls-export" href="{href}">{text}</a>{filler}</body></html>').encode('utf-8')
+
+
+def route(host, path, query):
+    """ Return (content type, body) for the request, None if there is nothing there """
+    rows = int(query.get('rows', [settings.rows])[0])
+    parts = [p for p in path.split('/') if p]
+    if host == 'www.blackrock.com':
+        if path.endswith('.ajax'):
+            return 'text/csv', ishares_csv(query['fund'][0], rows)
+        fund = parts[-1].upper()
+        href = f'/au/individual/products/{parts[-2]}/fund/1478358644060.ajax?fileType=csv&fund={fund}&dataType=fund'
+        return 'text/html', landing_page(f'iShares {fund}', href, 'Download Holdings')
+    if host == 'www.betashares.com.au':
+        if path.endswith('Holdings.csv'):
+            return 'text/csv', betashares_csv(parts[-1].split('-')[0], rows)
+        fund = parts[-1].upper()
+        return 'text/html', landing_page(f'BetaShares {fund}', f'files/csv/{fund}-Holdings.csv', 'Holdings')
+    if host == 'www.ssga.com' and path.endswith('.xlsx'):
+        fund = parts[-1][len('holdings-daily-au-en-'):-len('.xlsx')]
+        return 'application/vnd.ms-excel', ssga_xlsx(fund, rows)
+    if host == 'www2.asx.com.au':
+        if path.endswith('asx-funds-statistics'):
+            return 'text/html', asx_statistics_page()
+        if path.endswith('.xlsx'):
+            return 'application/vnd.ms-excel', asx_workbook(int(parts[-2]), int(parts[-1][:2]), rows)
+    return None
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real sites
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        host, _, path = url.path.lstrip('/').partition('/')
+        delay = settings.latency * random.uniform(0.5, 1.5)
+        if random.random() < settings.slow_rate:
+            delay += SLOW_SECONDS
+        time.sleep(delay)
+        if random.random() < settings.error_rate:
+            return self.reply(503, 'text/plain', b'stand-in error')
+        found = route(host, '/' + path, parse_qs(url.query))
+        if found is None:
+            return self.reply(404, 'text/html', b'<html><body>Not found</body></html>')
+        self.reply(200, *found)
+
+    def reply(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_fund_lists(dir_name, funds):
+    """ Fund lists in the layout of the real ones, linking to the sites the stand-in plays """
+    import pandas as pd
+    os.makedirs(dir_name, exist_ok=True)
+    lists = {
+        'iShares List.xlsx': ('iShares', [f'https://www.blackrock.com/au/individual/products/{270000 + n}/{code.lower()}'
+                                          for n, code in enumerate(fund_codes('IS', funds))], fund_codes('IS', funds)),
+        'BetaShares List.xlsx': ('BetaShares', [f'https://www.betashares.com.au/fund/{code.lower()}/'
+                                                for code in fund_codes('BS', funds)], fund_codes('BS', funds)),
+        'State Street List.xlsx': ('State Street', [f'https://www.ssga.com/au/en_gb/individual/etfs/funds/{code.lower()}'
+                                                    for code in fund_codes('SS', funds)], fund_codes('SS', funds)),
+    }
+    for file_name, (issuer, links, codes) in lists.items():
+        pd.DataFrame({'ETF Category': 'Equity - Global', 'ASX Code': codes, 'Issuer': issuer, 'Link': links}) \
+            .to_excel(os.path.join(dir_name, file_name), index=False)
+        print(f'Wrote {len(codes)} funds to {os.path.join(dir_name, file_name)}')
+
+
+# ============================
+# MAIN PROGRAM : START SCRIPT
+# ============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local stand-in for the issuer web sites')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--rows', type=int, default=ROWS, help='rows in every holdings file')
+    parser.add_argument('--latency', type=float, default=LATENCY, help='seconds added to every response')
+    parser.add_argument('--slow-rate', type=float, default=SLOW_RATE,
+                        help=f'share of the responses that take {SLOW_SECONDS} seconds more')
+    parser.add_argument('--error-rate', type=float, default=ERROR_RATE, help='share of the responses that are 503')
+    parser.add_argument('--fund-lists', metavar='DIR', help='write fund lists pointing at the stand-in to DIR')
+    parser.add_argument('--funds', type=int, default=FUNDS, help='funds per issuer in the fund lists')
+    settings = parser.parse_args()
+
+    if settings.fund_lists:
+        write_fund_lists(settings.fund_lists, settings.funds)
+    server = ThreadingHTTPServer(('127.0.0.1', settings.port), StandInHandler)
+    print(f'Issuer stand-in on http://127.0.0.1:{settings.port} ({settings.rows} rows per file, '
+          f'latency {settings.latency}s, slow {settings.slow_rate:.0%}, errors {settings.error_rate:.0%})')
+    server.serve_forever()
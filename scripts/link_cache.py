@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+On-disk cache of the holdings file link found on each fund's landing page
+
+iShares, BetaShares and ETF Securities only publish the holdings file as a link
+on the product page, which almost never changes. The link found for a fund is
+saved keyed by fund and landing page, and get_file tries it first. The landing
+page is only scraped again when the saved link answers 404 or 410 or with
+something that is not a spreadsheet, a timeout or an outage keeps the link.
+"""
+
+from datetime import datetime
+import json
+import os
+from threading import Lock
+import http_session
+
+CACHE_FILE = 'holdings-links.json'
+GONE_STATUSES = (404, 410)  # answers that mean the saved link no longer works
+
+cache_file = None  # where the links are saved, None keeps them in memory only
+links = {}  # 'fund|landing page' -> {'file_url': ..., 'saved': ...}
+links_lock = Lock()
+
+
+def load(file_name=CACHE_FILE):
+    """ Load the saved links from file_name, later changes are saved back to it, None keeps them in memory """
+    global cache_file, links
+    with links_lock:
+        cache_file = file_name
+        links = {}
+        if not file_name:
+            return
+        try:
+            with open(file_name) as f:
+                links = json.load(f)
+        except (FileNotFoundError, ValueError):
+            links = {}
+
+
+def save():
+    """ Write the links to the cache file, call with links_lock held """
+    if not cache_file:
+        return
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(links, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, cache_file)  # never leave a half written cache behind
+
+
+def cache_key(fund, link):
+    return f'{fund}|{link}'
+
+
+def cached_file_url(fund, link):
+    """ Return the saved holdings file link of the fund, None if there isn't one """
+    with links_lock:
+        entry = links.get(cache_key(fund, link))
+    return entry['file_url'] if entry else None
+
+
+def remember(fund, link, file_url):
+    with links_lock:
+        links[cache_key(fund, link)] = {'file_url': file_url, 'saved': datetime.now().isoformat(timespec='seconds')}
+        save()
+
+
+def forget(fund, link):
+    with links_lock:
+        if links.pop(cache_key(fund, link), None) is not None:
+            save()
+
+
+def is_spreadsheet(res):
+    """ True if the response looks like a holdings file and not an error or HTML page """
+    if res.status_code == 304:  # not modified, the cached copy is still good
+        return True
+    if res.status_code != 200:
+        return False
+    if 'html' in res.headers.get('Content-Type', '').lower():
+        return False
+    return not res.content[:256].lstrip().startswith(b'<')
+
+
+def get_file(fund, link, find_file_url, **kwargs):
+    """ Get the holdings file of the fund
+    Tries the saved file link first. If there is none, or it answers 404 / 410 or
+    with something that is not a spreadsheet, find_file_url(fund, link) scrapes the
+    landing page for it, it returns None if the link can't be found. Any other error
+    of the saved link (timeout, open circuit, 5xx) is raised and the link is kept. kwargs are passed on to http_session.get.
+    Returns the response, or None if no file link was found """
+    file_url = cached_file_url(fund, link)
+    if file_url:
+        # a timeout, an open circuit or the deadline goes to the caller, the link is kept
+        res = http_session.get(file_url, **kwargs)
+        if is_spreadsheet(res):
+            return res
+        if res.status_code not in GONE_STATUSES and res.status_code != 200:
+            res.raise_for_status()  # e.g. still a 5xx after the retries, the link is kept
+            return res
+        forget(fund, link)  # gone, or a page instead of the spreadsheet
+
+    file_url = find_file_url(fund, link)
+    if not file_url:
+        return None
+    res = http_session.get(file_url, **kwargs)
+    if is_spreadsheet(res):
+        remember(fund, link, file_url)
+    return res
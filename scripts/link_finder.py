@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Find one element of a landing page without parsing the whole page
+
+The product pages are large and the scripts only want one link or button on
+them. find_element streams the page into lxml's incremental HTML parser and
+stops, and stops downloading, as soon as the element is found.
+
+The matchers say what to look for:
+    link_text('Download Holdings')         <a> with that text
+    href_matching(re.compile(r'\\.xlsx'))   any element whose href matches
+    button_text('CSV File')                <button> with that text
+    inside('HoldingTable', matcher)        matcher, below the element with that id
+"""
+
+import re
+from lxml import etree
+import http_session
+
+CHUNK_SIZE = 16 * 1024  # bytes of the page parsed at a time
+
+
+def text_of(element):
+    return ''.join(element.itertext()).strip()
+
+
+def link_text(text):
+    """ Match an <a> whose text is text """
+    return lambda element: element.tag == 'a' and text_of(element) == text
+
+
+def button_text(text):
+    """ Match a <button> whose text is text """
+    return lambda element: element.tag == 'button' and text_of(element) == text
+
+
+def href_matching(pattern):
+    """ Match any element with an href the regular expression pattern is found in """
+    pattern = re.compile(pattern)
+    return lambda element: bool(pattern.search(element.get('href') or ''))
+
+
+def inside(element_id, match):
+    """ Match what match matches, if it is below the element with id element_id """
+    def matcher(element):
+        return match(element) and any(a.get('id') == element_id for a in element.iterancestors())
+    return matcher
+
+
+def find_element(url, match, **kwargs):
+    """ Download the page at url until an element match(element) is true for is found
+    kwargs are passed on to http_session.get.
+    Returns the element, None if the page doesn't have one """
+    parser = etree.HTMLPullParser(events=('end',))
+    res = http_session.get(url, stream=True, **kwargs)
+    try:
+        for chunk in res.iter_content(CHUNK_SIZE):
+            parser.feed(chunk)
+            found = first_match(parser, match)
+            if found is not None:
+                return found
+        parser.close()
+        return first_match(parser, match)
+    finally:
+        res.close()  # whatever is left of the page is never downloaded
+
+
+def first_match(parser, match):
+    for _, element in parser.read_events():
+        if match(element):
+            return element
+    return None
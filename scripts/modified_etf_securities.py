@@ -30,6 +30,7 @@ import re
 import os
 import requests
 import pandas as pd
+from frame_accumulator import FrameAccumulator
 from bs4 import BeautifulSoup
 
 
@@ -191,7 +192,7 @@ lf.write('\n'+'-'*75)
 # After renaming columns, keep only these ones in the final file
 # Note that this also determines the column order in the Excel file.
 COL_DISPLAY = ['Issuer','etf ticker','Security Ticker','Country Code','Security Name','Weight %','Market Value', 'Rate','Maturity date','Sector','Country']
-all_funds = pd.DataFrame()  # empty output frame to add to
+funds_holdings = FrameAccumulator()  # the holdings of every fund, put together once at the end
 
 # load all latest products
 get_all_products(BASE_URL, PRODUCT_URL)
@@ -224,13 +225,14 @@ for i in range(len(fund_list)):
             # holdings['ETF Category'] = fund_list.loc[i,'ETF Category']
             # holdings['Issuer'] = fund_list.loc[i,'Issuer']
             holdings['Product Name'] = fund_list.loc[i,'Product Name']
-            all_funds = all_funds.append(holdings)
+            funds_holdings.add(holdings)
             # all_funds.to_excel(ALL_ETF_SECURITIES_FILE, sheet_name='ETF', index=False, freeze_panes=(1,0))
             # write out the combined DF every time in case of crash
     else:
         writelog(f'{fund}\t{issuer}\tSKIPPING, not a valid link')
 
 # Saving all at the end - riskier
+all_funds = funds_holdings.frame()
 all_funds.to_excel(ALL_ETF_SECURITIES_FILE, sheet_name='ETFS', index=False, freeze_panes=(1,0))
 writelog(f'Saved the combined file {ALL_ETF_SECURITIES_FILE} size {all_funds.shape}')
 
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Save the combined tables as a partitioned Parquet dataset
+
+Writing the combined table to one huge xlsx sheet is the slowest step of a
+run, and Power BI has to parse it all again to read it. write saves the table
+as Parquet under root_dir, a folder per partition (e.g. Issuer=.../as_of=...),
+zstd compressed and dictionary encoded, the categoricals of compaction as
+dictionaries. Power BI and other jobs can read the folder as one table, or
+only the partitions they need.
+
+Needs pyarrow (pip install pyarrow), without it write only says it was skipped.
+"""
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+COMPRESSION = 'zstd'
+COMPRESSION_LEVEL = 3
+
+
+def available():
+    return pq is not None
+
+
+def arrow_table(df):
+    """ The frame as an arrow table, columns mixing numbers and text are written as text """
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        mixed = {col: as_text(df[col]) for col in df.columns if is_object(df[col])}
+        return pa.Table.from_pandas(df.assign(**mixed), preserve_index=False)
+
+
+def is_object(values):
+    """ True for columns of python objects, categoricals of them too """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.categories.dtype == object
+    return values.dtype == object
+
+
+def as_text(values):
+    text = values.astype(object).map(str, na_action='ignore')
+    return text.astype('category') if isinstance(values.dtype, pd.CategoricalDtype) else text
+
+
+def write(df, root_dir, partition_cols, as_of=None):
+    """ Save df to the Parquet dataset in root_dir, a folder per value of partition_cols
+    as_of (a date) adds an as_of column of it to the partitions. The partitions written
+    replace what an earlier run wrote for them. Returns a line for the log """
+    if not available():
+        return f'pyarrow is not installed, not saving {root_dir}'
+    if df.empty:
+        return f'Nothing to save to {root_dir}'
+    partition_cols = list(partition_cols)
+    if as_of is not None:
+        df = df.assign(as_of=as_of.strftime('%Y-%m-%d'))
+        partition_cols.append('as_of')
+    pq.write_to_dataset(arrow_table(df), root_dir, partition_cols=partition_cols,
+                        compression=COMPRESSION, compression_level=COMPRESSION_LEVEL, use_dictionary=True,
+                        existing_data_behavior='delete_matching', basename_template='part-{i}.parquet')
+    return f'Saved the combined file {root_dir} (parquet by {", ".join(partition_cols)}) size {df.shape}'
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Download in threads, parse in processes
+
+Reading an xlsx with pandas is pure Python and holds the GIL, so fetching the
+workbooks in more threads only makes them wait longer for their turn to be
+parsed. download_and_parse downloads the files in a few threads, hands each
+downloaded file to a pool of worker processes, one per core, for parsing and
+gives the parsed frames back in the order of the items, each as soon as it
+and all the ones before it are done, so the caller can add them up while the
+rest are still being downloaded and parsed.
+
+When the files are fetched in threads of their own (the issuer scripts), start
+starts the worker processes once and run(parse, ...) hands a file from the
+fetch thread to them and waits for its frame.
+
+The parse function is run in another process: it has to be a module level
+function of an importable module (or a functools.partial of one), and its
+arguments and result are pickled. The workers are started with spawn on
+every platform: forked from a process whose fetch threads hold locks (the
+requests pool, logging, the rate limiter), a worker could inherit a held lock
+and hang. A spawned worker starts by importing the main script, so the script
+must do its work under if __name__ == "__main__".
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from threading import Lock
+from fund_runner import fetch_in_order
+
+DOWNLOAD_WORKERS = 4  # files downloaded at the same time
+PARSE_PROCESSES = os.cpu_count() or 1  # worker processes parsing the files
+START_METHOD = 'spawn'  # not fork, the workers are started while the fetch threads run
+
+pool = None  # the worker processes of run, None parses in the calling thread
+pool_lock = Lock()
+
+
+def download_and_parse(items, download, parse, download_workers=DOWNLOAD_WORKERS, parse_processes=PARSE_PROCESSES):
+    """ download(item) the file of every item and parse(item, file_name) it in a worker process
+    download returns the name of a temporary file, or None if there is nothing to parse,
+    the file is removed once it is parsed. Yields (item, parsed) in the order of items,
+    parsed is None for the items download gave nothing for. parse_processes of 1
+    parses in this process """
+    items = list(items)
+    if parse_processes <= 1:
+        yield from zip(items, fetch_in_order(items, lambda item: parse_file(parse, item, download(item)),
+                                             max_workers=download_workers))
+        return
+
+    with ProcessPoolExecutor(max_workers=parse_processes, mp_context=multiprocessing.get_context(START_METHOD)) as pool:
+        def download_then_parse(item):
+            file_name = download(item)
+            if file_name is None:
+                return None
+            try:
+                # this thread waits for a process to parse it while the others go on downloading
+                return pool.submit(parse, item, file_name).result()
+            finally:
+                os.remove(file_name)
+
+        yield from zip(items, fetch_in_order(items, download_then_parse, max_workers=download_workers))
+
+
+def parse_file(parse, item, file_name):
+    if file_name is None:
+        return None
+    try:
+        return parse(item, file_name)
+    finally:
+        os.remove(file_name)
+
+
+def start(parse_processes=PARSE_PROCESSES):
+    """ Start the worker processes of run, parse_processes of 1 has run parse in the calling thread """
+    global pool
+    with pool_lock:
+        if pool is None and parse_processes > 1:
+            pool = ProcessPoolExecutor(max_workers=parse_processes,
+                                       mp_context=multiprocessing.get_context(START_METHOD))
+
+
+def run(parse, *args):
+    """ parse(*args) in a worker process, the calling thread waits for its result """
+    if pool is None:
+        return parse(*args)
+    return pool.submit(parse, *args).result()
+
+
+def stop():
+    """ Stop the worker processes of run """
+    global pool
+    with pool_lock:
+        if pool is not None:
+            pool.shutdown()
+            pool = None
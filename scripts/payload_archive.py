@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Archive of every holdings file downloaded, to rebuild past days without the web
+
+The issuers only publish today's holdings, so when a column mapping or a
+skiprows changes the days already scraped can't be fixed by scraping again.
+save keeps the body of every holdings file downloaded in the archive folder,
+compressed (zstd with pip install zstandard, else gzip) and named by its
+SHA-256, so a file that doesn't change from one day to the next is stored
+once. index.jsonl records one line per fund, issuer and day with the file it
+got. When the issuer answers 304 Not Modified the day gets the fund's last
+file again.
+
+reparse reads the files of a range of days back as responses and parses
+them again in a pool of threads, one day at a time, each file handed to the
+parse_pool worker processes when the script started them. A fund's file that
+is the same as the day before is not parsed again. rebuild is the --reparse
+of the issuer scripts: it saves each day's combined holdings again, to the
+Parquet dataset or an xlsx file, and to the history.
+"""
+
+from datetime import datetime
+import gzip
+from hashlib import sha256
+import json
+import os
+import tempfile
+from threading import Lock
+import requests
+from requests.structures import CaseInsensitiveDict
+import compaction
+import excel_writer
+from frame_accumulator import FrameAccumulator
+from fund_runner import fetch_in_order
+import holdings_history
+import parquet_output
+import parse_pool
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_DIR = 'raw'
+INDEX_FILE = 'index.jsonl'
+ZSTD_LEVEL = 10
+GZIP_LEVEL = 6
+REPARSE_WORKERS = 8  # files parsed at the same time by reparse
+
+archive_dir = None  # None archives nothing
+entries = []  # the index lines, in the order they were saved
+last_file = {}  # (issuer, fund) -> the index line of its last file
+lock = Lock()
+
+
+def load(dir_name=ARCHIVE_DIR):
+    """ Archive to dir_name, create it if it doesn't exist and read its index, None archives nothing """
+    global archive_dir, entries, last_file
+    with lock:
+        archive_dir = dir_name
+        entries = []
+        last_file = {}
+        if archive_dir is None:
+            return
+        os.makedirs(os.path.join(archive_dir, 'objects'), exist_ok=True)
+        try:
+            with open(os.path.join(archive_dir, INDEX_FILE)) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # the last line of a run that died while writing it
+                    entries.append(entry)
+                    last_file[entry['issuer'], entry['fund']] = entry
+        except FileNotFoundError:
+            pass
+
+
+def compress(body):
+    """ The compressed body and the extension of its file """
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body), 'zst'
+    return gzip.compress(body, compresslevel=GZIP_LEVEL), 'gz'
+
+
+def decompress(data, file_name):
+    if file_name.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f'{file_name} is zstd compressed, pip install zstandard to read it')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def store(body):
+    """ Save the body under its hash unless it is already there, return the hash and its file """
+    digest = sha256(body).hexdigest()
+    folder = os.path.join(archive_dir, 'objects', digest[:2])
+    for ext in ('zst', 'gz'):
+        file_name = f'objects/{digest[:2]}/{digest}.{ext}'
+        if os.path.exists(os.path.join(archive_dir, file_name)):
+            return digest, file_name
+    data, ext = compress(body)
+    file_name = f'objects/{digest[:2]}/{digest}.{ext}'
+    os.makedirs(folder, exist_ok=True)
+    # a temporary file of its own, threads archiving the same file at once must not share one
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=folder)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, os.path.join(archive_dir, file_name))  # never a half written file under the hash
+    return digest, file_name
+
+
+def add_entry(entry):
+    """ Append the line to the index, call with lock held """
+    with open(os.path.join(archive_dir, INDEX_FILE), 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+    entries.append(entry)
+    last_file[entry['issuer'], entry['fund']] = entry
+
+
+def save(issuer, fund, day, res):
+    """ Archive the holdings file of the fund downloaded on day (YYYYMMDD)
+    A 304 Not Modified answer archives the fund's last file again for the day,
+    any other answer but 200 is not archived """
+    if archive_dir is None or res is None or res.status_code not in (200, 304):
+        return
+    if res.status_code == 304:
+        with lock:
+            last = last_file.get((issuer, fund))
+            if last is not None and last['day'] != day:
+                add_entry(dict(last, day=day, saved=datetime.now().isoformat(timespec='seconds')))
+        return
+    digest, file_name = store(res.content)
+    entry = {'day': day, 'issuer': issuer, 'fund': fund, 'url': res.url, 'sha256': digest, 'file': file_name,
+             'size': len(res.content), 'content_type': res.headers.get('Content-Type', ''),
+             'encoding': res.encoding, 'saved': datetime.now().isoformat(timespec='seconds')}
+    with lock:
+        last = last_file.get((issuer, fund))
+        if last is None or (last['day'], last['sha256']) != (day, digest):  # a run again the same day
+            add_entry(entry)
+
+
+def payloads(first_day, last_day):
+    """ The index lines of the days from first_day to last_day (YYYYMMDD), by day
+    and in the order they were saved, only the last one of a fund for a day """
+    with lock:
+        latest = {}
+        for entry in entries:
+            if first_day <= entry['day'] <= last_day:
+                latest[entry['day'], entry['issuer'], entry['fund']] = entry
+    return sorted(latest.values(), key=lambda entry: entry['day'])
+
+
+def response(entry):
+    """ The archived file of the index line as the response it came in """
+    file_name = entry['file']
+    with open(os.path.join(archive_dir, file_name), 'rb') as f:
+        body = decompress(f.read(), file_name)
+    res = requests.Response()
+    res.status_code = 200
+    res.headers = CaseInsensitiveDict({'Content-Type': entry.get('content_type', '')})
+    res.encoding = entry.get('encoding')
+    res.url = entry.get('url', '')
+    res.reason = 'Archived'
+    res._content = body
+    res._content_consumed = True
+    return res
+
+
+def reparse(first_day, last_day, parse, max_workers=REPARSE_WORKERS):
+    """ Parse the files archived from first_day to last_day again, parse(fund, res) returns
+    the holdings frame of a file. Yields (day, [(index line, holdings), ...]) for each day in
+    order, holdings is the exception raised if the file could not be parsed. When a fund
+    has the same file as the day before it is not parsed again, its holdings are copied """
+    last_parsed = {}  # fund -> (sha256, holdings) of the last file parsed for it
+
+    def parse_entry(entry):
+        last = last_parsed.get(entry['fund'])
+        if last is not None and last[0] == entry['sha256']:
+            return last[1].copy()
+        try:
+            df = parse_pool.run(parse, entry['fund'], response(entry))  # in a worker process if started
+        except Exception as e:
+            return e
+        last_parsed[entry['fund']] = (entry['sha256'], df)
+        return df.copy()
+
+    days = {}
+    for entry in payloads(first_day, last_day):
+        days.setdefault(entry['day'], []).append(entry)
+    for day, day_entries in days.items():
+        yield day, list(zip(day_entries, fetch_in_order(day_entries, parse_entry, max_workers=max_workers)))
+
+
+def rebuild(first_day, last_day, parse, categories, output_file, sheet_name, reparse_dir, parquet_dir=None,
+            history_file=None, max_workers=REPARSE_WORKERS):
+    """ Rebuild the combined holdings of the days from first_day to last_day from the archived files
+    Each day goes to the Parquet dataset in parquet_dir, or when there is none or no pyarrow to
+    reparse_dir as the day's output_file, and to history_file if given. categories maps a fund to
+    its ETF Category. Yields lines for the log """
+    for day, parsed in reparse(first_day, last_day, parse, max_workers=max_workers):
+        day_holdings = FrameAccumulator()
+        for entry, holdings in parsed:
+            if isinstance(holdings, Exception):
+                yield f'{entry["fund"]}\t{entry["issuer"]}\t{day}\tCould not parse the archived file: {holdings}'
+                continue
+            holdings['ETF Category'] = categories.get(entry['fund'], '')
+            holdings['Issuer'] = entry['issuer']
+            day_holdings.add(holdings)
+        day_funds = compaction.compact(day_holdings.frame())[0]
+        as_of = datetime.strptime(day, '%Y%m%d')
+        if parquet_dir and parquet_output.available():  # the day's partitions replace what was saved for it
+            yield parquet_output.write(day_funds, parquet_dir, ['Issuer'], as_of=as_of)
+        else:
+            save_file = f'{reparse_dir}\\{day}_{os.path.basename(output_file)}'
+            excel_writer.write_xlsx(day_funds, save_file, sheet_name=sheet_name)
+            yield f'Saved the rebuilt file {save_file} size {day_funds.shape}'
+        if history_file:
+            yield holdings_history.update(day_funds, history_file, as_of)
+
+
+def reparse_days(args, default=None):
+    """ (first day, last day) from --reparse FIRST_DAY [LAST_DAY] in args, days as YYYYMMDD, else default """
+    if '--reparse' not in args:
+        return default
+    days = [arg for arg in args[args.index('--reparse') + 1:][:2] if not arg.startswith('--')]
+    if not days:
+        raise ValueError('--reparse needs the first day to rebuild, as YYYYMMDD')
+    return days[0], days[-1]
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Per host rate limiter with adaptive (AIMD) concurrency
+
+Every request goes through the limiter of its host: a token bucket for the
+request rate plus a limit on the requests in flight. While the host answers
+quickly and without errors both grow additively, on a 429, a 5xx, a timeout, a
+failed or reset connection or a response much slower than usual to start (the
+time to its headers, not to download its body) they are cut multiplicatively. Each issuer
+then settles on the most it will take without manual tuning, report() gives
+the rate and concurrency each host ended up with.
+"""
+
+from collections import deque
+from threading import Condition, Lock
+import time
+
+START_RATE = 4.0  # requests per second a host starts with
+MIN_RATE = 0.2
+MAX_RATE = 50.0
+RATE_STEP = 0.2  # added to the rate for every healthy response
+
+START_CONCURRENCY = 2.0  # requests in flight a host starts with
+MIN_CONCURRENCY = 1.0
+MAX_CONCURRENCY = 16.0
+
+DECREASE = 0.5  # rate and concurrency are multiplied by this on a throttle signal
+SLOW_FACTOR = 3.0  # a response this many times slower than the host's average is a throttle signal
+LATENCY_SMOOTHING = 0.2  # weight of the newest response in the average latency
+LATENCY_SAMPLES = 200  # recent response times kept per host for latency_percentile
+MIN_LATENCY_SAMPLES = 20  # fewer than this and latency_percentile doesn't guess
+
+
+class HostLimit:
+    """ Token bucket and AIMD limit of the requests in flight for one host """
+
+    def __init__(self, host):
+        self.host = host
+        self.rate = START_RATE
+        self.concurrency = START_CONCURRENCY
+        self.tokens = 1.0
+        self.refilled = time.monotonic()
+        self.in_flight = 0
+        self.avg_latency = None
+        self.last_decrease = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.cond = Condition()
+
+    def refill(self, now):
+        self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def acquire(self):
+        """ Block until a request to the host is allowed """
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                self.refill(now)
+                if self.in_flight < int(self.concurrency) and self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    self.in_flight += 1
+                    return
+                wait = (1.0 - self.tokens) / self.rate if self.tokens < 1.0 else None
+                self.cond.wait(wait)
+
+    def release(self, latency, throttled, duration=None):
+        """ Record how the request went and adapt the limits, latency is the time to the response
+        headers, duration the whole request's (latency if None) for latency_percentile """
+        with self.cond:
+            self.in_flight -= 1
+            self.requests += 1
+            slow = self.avg_latency is not None and latency > SLOW_FACTOR * self.avg_latency
+            if throttled or slow:
+                self.throttled += 1
+                self.decrease()
+            else:
+                self.rate = min(MAX_RATE, self.rate + RATE_STEP)
+                self.concurrency = min(MAX_CONCURRENCY, self.concurrency + 1.0 / self.concurrency)
+            if not throttled:
+                self.latencies.append(latency if duration is None else duration)
+                if self.avg_latency is None:
+                    self.avg_latency = latency
+                else:
+                    self.avg_latency += LATENCY_SMOOTHING * (latency - self.avg_latency)
+            self.cond.notify_all()
+
+    def free(self):
+        """ Give back the place of a request that failed without telling anything about the host """
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def latency_percentile(self, percent):
+        """ The percent percentile of the host's recent response times, None if too few are known """
+        with self.cond:
+            latencies = sorted(self.latencies)
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+    def decrease(self):
+        # the requests already in flight see the same overload, only cut once per round trip
+        now = time.monotonic()
+        if now - self.last_decrease < (self.avg_latency or 1.0):
+            return
+        self.last_decrease = now
+        self.rate = max(MIN_RATE, self.rate * DECREASE)
+        self.concurrency = max(MIN_CONCURRENCY, self.concurrency * DECREASE)
+
+
+host_limits = {}
+host_limits_lock = Lock()
+
+
+def for_host(host):
+    """ Return the limiter of the host, create it on first use """
+    with host_limits_lock:
+        if host not in host_limits:
+            host_limits[host] = HostLimit(host)
+        return host_limits[host]
+
+
+def is_throttle_status(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def report():
+    """ One line per host with the rate and concurrency it settled on """
+    with host_limits_lock:
+        limits = list(host_limits.values())
+    return [f'{h.host}\tsettled on {h.rate:.1f} requests/s, {int(h.concurrency)} in flight'
+            f'\t({h.requests} requests, {h.throttled} throttled)' for h in limits]
@@ -26,6 +26,7 @@ from datetime import datetime
 import os
 import requests
 import pandas as pd
+from frame_accumulator import FrameAccumulator
 
 # CONSTANTS Configurations
 INVESTMENT_PRODUCTS_LIST = r'..\templates\state-street\State Street List.xlsx'
@@ -125,7 +126,7 @@ lf.write('\n' + '-' * 75)
 # Note that this also determines the column order in the Excel file.
 col_keep = ['Issuer', 'etf ticker', 'Security Ticker', 'Country Code', 'Security Name', 'Weight %', 'Market Value',
             'Rate', 'Maturity date', 'Sector', 'Country', 'Number of Shares', 'Local Price']
-all_funds = pd.DataFrame()  # empty output frame to add to
+funds_holdings = FrameAccumulator()  # the holdings of every fund, put together once at the end
 
 fund_list = pd.read_excel(INVESTMENT_PRODUCTS_LIST, engine="openpyxl", )
 fund_list.fillna('', inplace=True)  # convert NA to empty string (from float)
@@ -153,13 +154,14 @@ for i in range(len(fund_list)):
             # writelog(f'{fund}\t{issuer}\tAdding {len(holdings)} rows')
             holdings['ETF Category'] = fund_list.loc[i, 'ETF Category']
             holdings['Issuer'] = fund_list.loc[i, 'Issuer']
-            all_funds = all_funds.append(holdings)
+            funds_holdings.add(holdings)
             # all_funds.to_excel(ALL_STATE_STREET_SECURITIES_FILE, sheet_name='ETF', index=False, freeze_panes=(1,0))
             # write out the combined DF every time in case of crash
     else:
         writelog(f'{fund}\t{issuer}\tSKIPPING, not a valid link')
 
 # Saving all at the end - riskier
+all_funds = funds_holdings.frame()
 all_funds.to_excel(ALL_STATE_STREET_SECURITIES_FILE, sheet_name='ETF', index=False, freeze_panes=(1, 0))
 writelog(f'Saved the combined file {ALL_STATE_STREET_SECURITIES_FILE} size {all_funds.shape}')
 
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Split issuer tickers into ticker, exchange code and security type
+
+The issuers write a holding's ticker in the Bloomberg style, with the parts
+separated by spaces ("1211 HK Equity", BetaShares and ETF Securities) or by
+a dash ("CBA-AU", State Street). split_ticker parses every distinct ticker of
+a column once with one compiled regular expression, with pyarrow's compute
+kernels when pyarrow is installed. It gives back the parts as columns:
+
+    Security Ticker   1211
+    Country Code      HK        (the Bloomberg exchange code)
+    Security Type     Equity    (empty if the ticker doesn't have one)
+    Country           Hong Kong (looked up from the exchange code)
+
+Country Code, Security Type and Country are categorical.
+"""
+
+import re
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = 'string[pyarrow]'  # str.extract runs in arrow's regex kernel
+except ImportError:
+    STRING_DTYPE = 'string'
+
+# Bloomberg market sectors ("yellow keys") a ticker can end with
+SECURITY_TYPES = ['Equity', 'Corp', 'Govt', 'Index', 'Comdty', 'Curncy', 'Mtge', 'Muni', 'Pfd']
+
+# Bloomberg exchange code -> country of the exchange
+EXCHANGE_COUNTRY = {
+    'AU': 'Australia', 'AT': 'Australia',
+    'NZ': 'New Zealand',
+    'US': 'United States', 'UN': 'United States', 'UW': 'United States', 'UQ': 'United States',
+    'UA': 'United States', 'UP': 'United States', 'UR': 'United States',
+    'CN': 'Canada', 'CT': 'Canada',
+    'LN': 'United Kingdom',
+    'HK': 'Hong Kong',
+    'CH': 'China', 'C1': 'China', 'C2': 'China',
+    'JP': 'Japan', 'JT': 'Japan',
+    'KS': 'South Korea', 'KQ': 'South Korea',
+    'TT': 'Taiwan',
+    'SP': 'Singapore',
+    'IN': 'India', 'IB': 'India', 'IS': 'India',
+    'IJ': 'Indonesia', 'MK': 'Malaysia', 'TB': 'Thailand', 'PM': 'Philippines',
+    'GR': 'Germany', 'GY': 'Germany',
+    'FP': 'France',
+    'NA': 'Netherlands',
+    'SW': 'Switzerland', 'SE': 'Switzerland', 'VX': 'Switzerland',
+    'SM': 'Spain',
+    'IM': 'Italy',
+    'BB': 'Belgium',
+    'ID': 'Ireland',
+    'PL': 'Portugal',
+    'AV': 'Austria',
+    'SS': 'Sweden', 'NO': 'Norway', 'DC': 'Denmark', 'FH': 'Finland',
+    'BZ': 'Brazil', 'MM': 'Mexico',
+    'SJ': 'South Africa',
+    'IT': 'Israel',
+}
+
+patterns = {}  # separator -> compiled ticker pattern
+
+
+def ticker_pattern(sep):
+    """ Compiled pattern of a ticker with its parts separated by sep, built on first use """
+    if sep not in patterns:
+        s = re.escape(sep)
+        types = "|".join(SECURITY_TYPES)
+        # a security type word is never the code: 'AAPL Equity' is ticker AAPL of type Equity
+        patterns[sep] = re.compile(rf'^\s*(?P<ticker>.+?)(?:{s}+(?P<code>(?!(?:{types})\s*$)[^{s}]+?))?'
+                                   rf'(?:\s+(?P<type>{types}))?\s*$')
+    return patterns[sep]
+
+
+def split_ticker(tickers, sep=' '):
+    """ Split the tickers (a Series) into a DataFrame of Security Ticker, Country Code,
+    Security Type and Country, with the same index """
+    codes, uniques = pd.factorize(tickers)  # each distinct ticker is parsed once, -1 for the missing ones
+    parts = pd.Series(uniques, dtype=STRING_DTYPE).str.extract(ticker_pattern(sep))
+    country = parts['code'].map(EXCHANGE_COUNTRY)  # a hash lookup per distinct ticker
+    return pd.DataFrame({'Security Ticker': parts['ticker'].array.take(codes, allow_fill=True),
+                         'Country Code': pd.Categorical(parts['code']).take(codes, allow_fill=True),
+                         'Security Type': pd.Categorical(parts['type']).take(codes, allow_fill=True),
+                         'Country': pd.Categorical(country).take(codes, allow_fill=True)},
+                        index=tickers.index)
+
+
+def add_ticker_columns(df, column, sep=' '):
+    """ Return df with the parts of the tickers in column added (see split_ticker)
+    a Country column the file already has is kept, the exchange's country only fills its gaps """
+    parts = split_ticker(df[column], sep)
+    if 'Country' in df.columns:
+        parts['Country'] = df['Country'].fillna(parts['Country'].astype(object))
+    return df.assign(**{col: parts[col] for col in parts.columns})